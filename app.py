@@ -1,5 +1,5 @@
 from flask import Flask, request, jsonify, session
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import emit, join_room, leave_room
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
@@ -11,6 +11,7 @@ import cloudinary.uploader
 from dotenv import load_dotenv
 
 from database import db
+from extensions import socketio, init_socketio
 from utils import generate_teengram_number, generate_device_fingerprint, award_points, check_ban_status
 
 load_dotenv()
@@ -20,7 +21,7 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 app.config['SESSION_TYPE'] = 'filesystem'
 
 # Initialize extensions
-socketio = SocketIO(app, cors_allowed_origins="*")
+init_socketio(app)
 limiter = Limiter(
     app,
     key_func=get_remote_address,
@@ -54,6 +55,16 @@ app.register_blueprint(api_bp, url_prefix='/api')
 # Socket events
 from sockets.chat_sockets import *
 
+# Background jobs
+import feed
+import timelines
+import stories
+from invalidation import invalidation_bus
+invalidation_bus.start()
+feed.start_reconciler(db)
+timelines.start_trimmer(db)
+stories.start_sweeper(db)
+
 @app.route('/')
 def index():
     return jsonify({"message": "Teengram API is running!"})
@@ -0,0 +1,57 @@
+"""Periodic background jobs.
+
+Runs on plain threads; under the gunicorn eventlet worker these are
+monkey-patched into green threads, so jobs must not hold the hub for long.
+"""
+import logging
+import threading
+
+logger = logging.getLogger('teengram.background')
+
+class PeriodicTask:
+    """Calls func every `interval` seconds, or sooner when trigger() is called"""
+    
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+    
+    def trigger(self):
+        """Run the job as soon as possible instead of waiting for the interval"""
+        self._wake.set()
+    
+    def stop(self, timeout=5.0):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def run_once(self):
+        try:
+            return self.func()
+        except Exception:
+            logger.exception("Background job %s failed", self.name)
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            self.run_once()
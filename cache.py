@@ -0,0 +1,147 @@
+"""In-process caches.
+
+LRUCache is a thread/greenlet-safe LRU with a per-entry TTL and
+hit/miss/eviction counters. Caches are per worker process: writers
+invalidate their own entry and publish the invalidation to the other
+workers through invalidation.py; the TTL only bounds staleness when that
+message is lost.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from invalidation import invalidation_bus
+
+class LRUCache:
+    def __init__(self, name, maxsize=1024, ttl=60.0, on_evict=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                removed = value
+            else:
+                self._data.move_to_end(key)
+                self._hits += 1
+                return value
+        
+        self._evicted(key, removed)
+        return default
+    
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        evicted = []
+        
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+                self._evictions += 1
+        
+        for old_key, (old_value, _) in evicted:
+            self._evicted(old_key, old_value)
+    
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return False
+            self._invalidations += 1
+        self._evicted(key, entry[0])
+        return True
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def _evicted(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations
+            }
+
+# Profiles by username; _profile_usernames maps user id -> cached username
+# so writers that only know the id can invalidate
+_profile_usernames = {}
+
+profile_cache = LRUCache(
+    'profiles',
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 5000)),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', 60)),
+    on_evict=lambda username, profile: _profile_usernames.pop(profile['id'], None)
+)
+
+def cache_profile(profile):
+    _profile_usernames[profile['id']] = profile['username']
+    profile_cache.set(profile['username'], profile)
+
+def invalidate_profile(user_id):
+    _drop_profile(user_id)
+    invalidation_bus.publish('profile', int(user_id))
+
+def _drop_profile(user_id):
+    username = _profile_usernames.get(int(user_id))
+    if username is not None:
+        profile_cache.invalidate(username)
+    sender_card_cache.invalidate(int(user_id))
+
+# Username and photo attached to outgoing chat messages, by user id
+sender_card_cache = LRUCache(
+    'sender_cards',
+    maxsize=int(os.getenv('SENDER_CARD_CACHE_SIZE', 20000)),
+    ttl=float(os.getenv('SENDER_CARD_CACHE_TTL', 600))
+)
+
+# Ban status by user id; banned entries expire exactly at ban_end and
+# clean entries after BAN_CACHE_CLEAR_TTL seconds (see check_ban_status)
+ban_cache = LRUCache(
+    'bans',
+    maxsize=int(os.getenv('BAN_CACHE_SIZE', 20000)),
+    ttl=float(os.getenv('BAN_CACHE_TTL', 300))
+)
+
+def invalidate_ban(user_id):
+    ban_cache.invalidate(int(user_id))
+    invalidation_bus.publish('ban', int(user_id))
+
+invalidation_bus.subscribe('profile', _drop_profile)
+invalidation_bus.subscribe('ban', ban_cache.invalidate)
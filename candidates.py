@@ -0,0 +1,170 @@
+"""Campus-connect candidate sampling.
+
+Approved user ids are kept in memory in one global pool plus pools per
+college and per city. A swipe batch draws random ids from a pool and
+rejects excluded ones (self, friends, recent skips) with set lookups,
+so its cost depends on the batch size, not on the number of users.
+Pools reload every CANDIDATE_POOL_REFRESH seconds and are patched in
+place, on every worker, when an admin approves or rejects a user.
+"""
+import os
+import random
+import threading
+import time
+
+from database import db
+from invalidation import invalidation_bus
+
+class IdPool:
+    """Set of ids with O(1) add/discard and O(1) uniform random pick"""
+    
+    def __init__(self):
+        self._ids = []
+        self._positions = {}
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def add(self, user_id):
+        if user_id not in self._positions:
+            self._positions[user_id] = len(self._ids)
+            self._ids.append(user_id)
+    
+    def discard(self, user_id):
+        position = self._positions.pop(user_id, None)
+        if position is None:
+            return
+        last = self._ids.pop()
+        if position < len(self._ids):
+            self._ids[position] = last
+            self._positions[last] = position
+    
+    def sample(self, count, exclude):
+        """Up to `count` distinct random ids not in `exclude`"""
+        if count <= 0 or not self._ids:
+            return []
+        
+        # Small or heavily excluded pools: filter exactly instead of rejecting
+        if len(self._ids) <= 4 * (count + len(exclude)):
+            eligible = [user_id for user_id in self._ids if user_id not in exclude]
+            return random.sample(eligible, min(count, len(eligible)))
+        
+        picked = []
+        seen = set(exclude)
+        for _ in range(count * 8):
+            user_id = self._ids[random.randrange(len(self._ids))]
+            if user_id not in seen:
+                seen.add(user_id)
+                picked.append(user_id)
+                if len(picked) == count:
+                    return picked
+        
+        # Unlucky draws: top up from an exact scan rather than return a short batch
+        eligible = [user_id for user_id in self._ids if user_id not in seen]
+        return picked + random.sample(eligible, min(count - len(picked), len(eligible)))
+
+class CandidatePools:
+    def __init__(self, database, refresh_interval=300.0):
+        self.db = database
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._all = IdPool()
+        self._by_college = {}
+        self._by_city = {}
+        self._users = {}  # id -> (college_name, city)
+    
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return
+        
+        with self._lock:
+            if self._loaded_at is not loaded_at:
+                return
+            
+            with self.db.connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, college_name, city FROM users WHERE status = 'approved'"
+                ).fetchall()
+            
+            self._all = IdPool()
+            self._by_college = {}
+            self._by_city = {}
+            self._users = {}
+            for row in rows:
+                self._add(row['id'], row['college_name'], row['city'])
+            self._loaded_at = time.monotonic()
+    
+    def _add(self, user_id, college_name, city):
+        self._users[user_id] = (college_name, city)
+        self._all.add(user_id)
+        self._by_college.setdefault(college_name, IdPool()).add(user_id)
+        self._by_city.setdefault(city, IdPool()).add(user_id)
+    
+    def _remove(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+        college_name, city = entry
+        self._all.discard(user_id)
+        self._by_college[college_name].discard(user_id)
+        self._by_city[city].discard(user_id)
+    
+    def refresh_user(self, user_id):
+        """Re-read one user after an approval, rejection or profile change"""
+        self._reload_user(user_id)
+        invalidation_bus.publish('candidates', int(user_id))
+    
+    def _reload_user(self, user_id):
+        if self._loaded_at is None:
+            return
+        with self.db.connection() as conn:
+            row = conn.execute(
+                "SELECT id, college_name, city FROM users WHERE id = ? AND status = 'approved'",
+                (user_id,)
+            ).fetchone()
+        with self._lock:
+            self._remove(int(user_id))
+            if row is not None:
+                self._add(row['id'], row['college_name'], row['city'])
+    
+    def sample(self, user_id, count, exclude, mode='random'):
+        """Random candidate ids for user_id.
+        
+        mode 'same_college' fills from the user's college, then their city;
+        'same_city' from their city; the rest comes from everyone.
+        """
+        self._ensure_loaded()
+        exclude = set(exclude)
+        exclude.add(user_id)
+        
+        with self._lock:
+            pools = []
+            if user_id in self._users:
+                college_name, city = self._users[user_id]
+                if mode == 'same_college':
+                    pools.append(self._by_college.get(college_name))
+                if mode in ('same_college', 'same_city'):
+                    pools.append(self._by_city.get(city))
+            pools.append(self._all)
+            
+            picked = []
+            for pool in pools:
+                if pool is None or len(picked) >= count:
+                    continue
+                batch = pool.sample(count - len(picked), exclude)
+                exclude.update(batch)
+                picked += batch
+        return picked
+    
+    def stats(self):
+        return {
+            'loaded': self._loaded_at is not None,
+            'users': len(self._all),
+            'colleges': len(self._by_college),
+            'cities': len(self._by_city)
+        }
+
+candidate_pools = CandidatePools(db, refresh_interval=float(os.getenv('CANDIDATE_POOL_REFRESH', 300)))
+invalidation_bus.subscribe('candidates', candidate_pools._reload_user)
@@ -0,0 +1,114 @@
+"""Materialized conversation summaries.
+
+One row per user pair (user_low < user_high) in the conversations table,
+holding the last message and an unread counter for each side. New
+messages update it through the trg_messages_conversation trigger, so
+every insert path (HTTP send, socket send, voice notes) keeps it current.
+
+Read state is a watermark per reader and conversation in read_watermarks:
+a message is seen once its id is <= the receiver's last_read_message_id.
+mark_read() advances the watermark with one UPSERT and re-derives the
+reader's unread counter from it; messages.is_seen is no longer written.
+"""
+
+def pair(user_a, user_b):
+    return min(user_a, user_b), max(user_a, user_b)
+
+def mark_read(cursor, reader_id, other_user_id, message_id=None):
+    """Advance reader's watermark to message_id (default: the latest message).
+    
+    Watermarks never move backwards, so re-reading older pages is a no-op.
+    Returns the watermark as stored, or None if there is no conversation.
+    """
+    reader_id, other_user_id = int(reader_id), int(other_user_id)
+    low, high = pair(reader_id, other_user_id)
+    column = 'unread_low' if reader_id == low else 'unread_high'
+    
+    cursor.execute('''
+        INSERT INTO read_watermarks (reader_id, other_user_id, last_read_message_id)
+        SELECT ?, ?, MIN(COALESCE(?, last_message_id), last_message_id)
+        FROM conversations WHERE user_low = ? AND user_high = ?
+        ON CONFLICT (reader_id, other_user_id) DO UPDATE SET
+            last_read_message_id = excluded.last_read_message_id,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE excluded.last_read_message_id > read_watermarks.last_read_message_id
+    ''', (reader_id, other_user_id, message_id, low, high))
+    
+    # Unread = messages from the other side above the watermark (an index range)
+    cursor.execute(f'''
+        UPDATE conversations SET {column} = (
+            SELECT COUNT(*) FROM messages
+            WHERE sender_id = ? AND receiver_id = ? AND id > (
+                SELECT last_read_message_id FROM read_watermarks
+                WHERE reader_id = ? AND other_user_id = ?
+            )
+        )
+        WHERE user_low = ? AND user_high = ? AND {column} != 0
+    ''', (other_user_id, reader_id, reader_id, other_user_id, low, high))
+    
+    return last_read(cursor, reader_id, other_user_id)
+
+def last_read(cursor, reader_id, other_user_id):
+    cursor.execute(
+        'SELECT last_read_message_id FROM read_watermarks WHERE reader_id = ? AND other_user_id = ?',
+        (reader_id, other_user_id)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def with_seen_state(cursor, user_a, user_b, messages):
+    """Dicts of messages with is_seen derived from both watermarks"""
+    watermarks = {
+        user_a: last_read(cursor, user_a, user_b) or 0,
+        user_b: last_read(cursor, user_b, user_a) or 0
+    }
+    result = []
+    for message in messages:
+        message = dict(message)
+        # 0/1 like the old column and like send_message returns
+        message['is_seen'] = int(message['id'] <= watermarks.get(message['receiver_id'], 0))
+        result.append(message)
+    return result
+
+def backfill_watermarks(conn):
+    """Seed watermarks from the legacy is_seen flags: the newest seen message per direction"""
+    conn.execute('''
+        INSERT OR IGNORE INTO read_watermarks (reader_id, other_user_id, last_read_message_id)
+        SELECT receiver_id, sender_id, MAX(id) FROM messages
+        WHERE is_seen = 1
+        GROUP BY receiver_id, sender_id
+    ''')
+
+def rebuild(conn):
+    """Recompute every summary from the messages table (backfill/repair)"""
+    has_watermarks = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'read_watermarks'"
+    ).fetchone() is not None
+    
+    def unread(reader, sender):
+        if not has_watermarks:
+            # Databases migrated before read watermarks existed
+            return 'u.is_seen = 0'
+        return f'''u.id > COALESCE((SELECT last_read_message_id FROM read_watermarks
+                              WHERE reader_id = g.{reader} AND other_user_id = g.{sender}), 0)'''
+    
+    conn.execute('DELETE FROM conversations')
+    conn.execute(f'''
+        INSERT INTO conversations (user_low, user_high, last_message_id, last_message_text,
+                                   last_message_at, last_sender_id, unread_low, unread_high)
+        SELECT g.user_low, g.user_high, m.id, m.text, m.created_at, m.sender_id,
+               (SELECT COUNT(*) FROM messages u
+                WHERE u.sender_id = g.user_high AND u.receiver_id = g.user_low
+                AND {unread('user_low', 'user_high')}),
+               (SELECT COUNT(*) FROM messages u
+                WHERE u.sender_id = g.user_low AND u.receiver_id = g.user_high
+                AND {unread('user_high', 'user_low')})
+        FROM (
+            SELECT MIN(sender_id, receiver_id) as user_low,
+                   MAX(sender_id, receiver_id) as user_high,
+                   MAX(id) as last_id
+            FROM messages
+            GROUP BY 1, 2
+        ) g
+        JOIN messages m ON m.id = g.last_id
+    ''')
\ No newline at end of file
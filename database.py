@@ -1,18 +1,362 @@
 import sqlite3
+import logging
 import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import hashlib
 
+from query_stats import QueryStats, InstrumentedCursor
+from db_executor import DBExecutor, OffloadedCursor
+
+logger = logging.getLogger('teengram.db')
+
+# Runtime PRAGMA profiles applied to every new connection
+DB_PROFILES = {
+    # Plain SQLite defaults (rollback journal, no busy timeout)
+    'default': {},
+    # WAL so readers never block the writer; waits out short write locks
+    'balanced': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': 5000,
+        'cache_size': -16000,  # 16MB
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'memory'
+    },
+    # Bigger cache/mmap for hosts with memory to spare
+    'throughput': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'busy_timeout': 10000,
+        'cache_size': -64000,  # 64MB
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'memory'
+    },
+    # WAL concurrency but fsync on every commit
+    'durable': {
+        'journal_mode': 'wal',
+        'synchronous': 'full',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 0,
+        'temp_store': 'default'
+    }
+}
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+
+class PooledConnection:
+    """Connection handed out by the pool; close() checks it back in instead of closing it"""
+    
+    def __init__(self, pool, raw):
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_query_stats', pool.query_stats)
+        object.__setattr__(self, '_executor', pool.executor)
+        # Handlers that return early without close() still give the connection back
+        object.__setattr__(self, '_release', weakref.finalize(self, pool.checkin, raw))
+    
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._raw, name, value)
+    
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return self._executor.run(self._raw.__exit__, exc_type, exc, tb)
+    
+    def cursor(self):
+        cursor = self._raw.cursor()
+        if self._executor.enabled:
+            cursor = OffloadedCursor(cursor, self._executor)
+        if self._query_stats is None:
+            return cursor
+        return InstrumentedCursor(cursor, self._query_stats, self._executor)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def commit(self):
+        self._executor.run(self._raw.commit)
+    
+    def rollback(self):
+        self._executor.run(self._raw.rollback)
+    
+    def close(self):
+        self._release()
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by threads/greenlets.
+    
+    Uses threading primitives, which eventlet monkey-patches into their
+    greenlet-aware equivalents under the gunicorn eventlet worker.
+    """
+    
+    def __init__(self, factory, max_size=10, timeout=5.0, max_idle=30.0, max_lifetime=3600.0,
+                 query_stats=None, executor=None):
+        self.factory = factory
+        self.query_stats = query_stats
+        self.executor = executor or DBExecutor(mode='inline')
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, released_at)], most recently used last
+        self._created = {}
+        self._size = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+    
+    def checkout(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    conn = None
+                    self._size += 1
+                    break
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                if not waited:
+                    self._waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+            
+            self._in_use += 1
+            self._checkouts += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        
+        try:
+            if conn is not None and not self._is_healthy(conn, created_at, released_at):
+                self._discard(conn, resize=False)
+                conn = None
+            if conn is None:
+                conn = self.executor.run(self.factory)
+                self._created[conn] = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        
+        return PooledConnection(self, conn)
+    
+    def checkin(self, conn):
+        try:
+            # Never hand an open transaction to the next borrower
+            if conn.in_transaction:
+                self.executor.run(conn.rollback)
+        except sqlite3.Error:
+            self._discard(conn)
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            return
+        
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, self._created.get(conn, 0), time.monotonic()))
+            self._cond.notify()
+    
+    def _is_healthy(self, conn, created_at, released_at):
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            return False
+        if now - released_at > self.max_idle:
+            # Stale handle: make sure it still works before reusing it
+            try:
+                self.executor.run(self._ping, conn)
+            except sqlite3.Error:
+                return False
+        return True
+    
+    @staticmethod
+    def _ping(conn):
+        return conn.execute('SELECT 1').fetchone()
+    
+    def _discard(self, conn, resize=True):
+        self._created.pop(conn, None)
+        try:
+            self.executor.run(conn.close)
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._discarded += 1
+            if resize:
+                self._size -= 1
+    
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _, _ in idle:
+            self._created.pop(conn, None)
+            conn.close()
+    
+    def stats(self):
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'peak_in_use': self._peak_in_use,
+                'saturation': round(self._in_use / self.max_size, 2),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded
+            }
+
 class Database:
-    def __init__(self, db_path='teengram.db'):
+    def __init__(self, db_path='teengram.db', profile=None, pragmas=None):
         self.db_path = db_path
+        self.profile = profile or os.getenv('DB_PROFILE', 'balanced')
+        if self.profile not in DB_PROFILES:
+            raise ValueError(f"Unknown database profile: {self.profile}")
+        self.pragmas = dict(DB_PROFILES[self.profile], **(pragmas or {}))
+        self.query_stats = None
+        if os.getenv('DB_QUERY_STATS', '1') == '1':
+            self.query_stats = QueryStats(slow_ms=float(os.getenv('DB_SLOW_QUERY_MS', 100)))
+        # Off-hub execution of sqlite3 calls under eventlet; see db_executor
+        self.executor = DBExecutor(
+            mode=os.getenv('DB_EXECUTOR', 'auto'),
+            threads=int(os.getenv('DB_EXECUTOR_THREADS', 8))
+        )
+        self.pool = ConnectionPool(
+            self._connect,
+            max_size=int(os.getenv('DB_POOL_SIZE', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            query_stats=self.query_stats,
+            executor=self.executor
+        )
+        # Connection of the unit of work running in this thread/greenlet
+        self._local = threading.local()
         self.init_database()
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def _connect(self):
+        # Pooled connections move between threads/greenlets
+        # Profiles without busy_timeout fail immediately on a locked database
+        busy_timeout = self.pragmas.get('busy_timeout', 0)
+        conn = sqlite3.connect(self.db_path, timeout=busy_timeout / 1000, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
         return conn
     
+    def get_connection(self):
+        return self.pool.checkout()
+    
+    @contextmanager
+    def connection(self):
+        """Check out a pooled connection for the duration of a with-block"""
+        conn = self.get_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Unit of work for the current request.
+        
+        Nested calls (e.g. award_points inside a route) join the outermost
+        transaction and share its connection; only the outermost block
+        commits, or rolls back if an exception escapes. Use immediate=True
+        for blocks that will write, so the write lock is taken up front
+        instead of failing to upgrade a read transaction.
+        
+        Side effects outside the database (caches, leaderboard, queues)
+        belong in after_commit() so a rollback does not leave them behind.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        
+        conn = self.get_connection()
+        self._local.conn = conn
+        self._local.hooks = {'commit': [], 'rollback': []}
+        outcome = 'rollback'
+        try:
+            if immediate:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+            conn.commit()
+            outcome = 'commit'
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            hooks = self._local.hooks[outcome]
+            self._local.conn = None
+            self._local.hooks = None
+            conn.close()
+            self._run_hooks(hooks)
+    
+    def _run_hooks(self, hooks):
+        for func, args in hooks:
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Transaction hook %r failed", func)
+    
+    def after_commit(self, func, *args):
+        """Call func(*args) once the outermost transaction commits.
+        
+        Runs immediately outside a transaction; dropped on rollback.
+        """
+        if getattr(self._local, 'conn', None) is None:
+            func(*args)
+        else:
+            self._local.hooks['commit'].append((func, args))
+    
+    def after_rollback(self, func, *args):
+        """Call func(*args) if the outermost transaction rolls back (no-op outside one)"""
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.hooks['rollback'].append((func, args))
+    
+    def pool_stats(self):
+        return dict(self.pool.stats(), executor=self.executor.stats())
+    
+    def describe_profile(self):
+        """Active profile name plus the PRAGMA values SQLite actually reports"""
+        with self.connection() as conn:
+            effective = {
+                name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in DB_PROFILES['balanced']
+            }
+        return {
+            'profile': self.profile,
+            'requested': self.pragmas,
+            'effective': effective
+        }
+    
     def init_database(self):
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -214,6 +558,12 @@ class Database:
         ''')
         
         conn.commit()
+        
+        # Indexes and later schema changes
+        if os.getenv('DB_AUTO_MIGRATE', '1') == '1':
+            from migrations import migrate
+            migrate(conn)
+        
         conn.close()
         
         # Create default admin
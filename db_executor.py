@@ -0,0 +1,124 @@
+"""Runs blocking sqlite3 calls off the eventlet hub.
+
+Under the gunicorn eventlet worker every greenlet shares one OS thread,
+so a query that takes 200ms (or waits 5s on busy_timeout for the write
+lock) freezes every socket in the process. With the executor active,
+pooled connections hand each execute/fetch/commit to eventlet's native
+thread pool (tpool) and the calling greenlet yields until it finishes.
+
+At most DB_EXECUTOR_THREADS calls run at once; further callers queue on
+a semaphore, and queue depth and wait times are reported in stats().
+DB_EXECUTOR=auto (default) offloads only when eventlet has monkey-patched
+threading; `inline` always runs calls directly, `tpool` forces offloading.
+"""
+import threading
+import time
+
+def _eventlet_active():
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+class DBExecutor:
+    def __init__(self, mode='auto', threads=8):
+        self.mode = mode
+        self.threads = threads
+        self._enabled = None
+        self._tpool = None
+        self._slots = threading.Semaphore(threads)
+        self._calls = 0
+        self._offloaded = 0
+        self._in_flight = 0
+        self._queued = 0
+        self._peak_queued = 0
+        self._wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._run_ms = 0.0
+    
+    @property
+    def enabled(self):
+        if self._enabled is None:
+            # Decided on first use: gunicorn patches before the app is imported
+            self._enabled = self.mode == 'tpool' or (self.mode == 'auto' and _eventlet_active())
+            if self._enabled:
+                from eventlet import tpool
+                tpool.set_num_threads(self.threads)
+                self._tpool = tpool
+        return self._enabled
+    
+    def run(self, func, *args, **kwargs):
+        self._calls += 1
+        if not self.enabled:
+            return func(*args, **kwargs)
+        
+        queued_at = time.perf_counter()
+        self._queued += 1
+        self._peak_queued = max(self._peak_queued, self._queued)
+        with self._slots:
+            self._queued -= 1
+            started = time.perf_counter()
+            wait_ms = (started - queued_at) * 1000
+            self._wait_ms += wait_ms
+            self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+            self._in_flight += 1
+            try:
+                return self._tpool.execute(func, *args, **kwargs)
+            finally:
+                self._in_flight -= 1
+                self._offloaded += 1
+                self._run_ms += (time.perf_counter() - started) * 1000
+    
+    def stats(self):
+        offloaded = self._offloaded
+        return {
+            'mode': self.mode,
+            'enabled': self.enabled,
+            'threads': self.threads,
+            'calls': self._calls,
+            'offloaded': offloaded,
+            'in_flight': self._in_flight,
+            'queue_depth': self._queued,
+            'peak_queue_depth': self._peak_queued,
+            'avg_wait_ms': round(self._wait_ms / offloaded, 3) if offloaded else 0,
+            'max_wait_ms': round(self._max_wait_ms, 3),
+            'avg_run_ms': round(self._run_ms / offloaded, 3) if offloaded else 0
+        }
+
+class OffloadedCursor:
+    """Cursor proxy that runs execute and fetch calls through the executor"""
+    
+    def __init__(self, cursor, executor):
+        self._cursor = cursor
+        self._executor = executor
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+    
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(100)
+            if not rows:
+                return
+            yield from rows
+    
+    def execute(self, sql, parameters=()):
+        self._executor.run(self._cursor.execute, sql, parameters)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        # Materialize generators here; they must not be consumed on the pool thread
+        self._executor.run(self._cursor.executemany, sql, list(seq_of_parameters))
+        return self
+    
+    def fetchone(self):
+        return self._executor.run(self._cursor.fetchone)
+    
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._executor.run(self._cursor.fetchmany)
+        return self._executor.run(self._cursor.fetchmany, size)
+    
+    def fetchall(self):
+        return self._executor.run(self._cursor.fetchall)
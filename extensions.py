@@ -0,0 +1,26 @@
+"""Extension instances shared by app.py and the socket handlers.
+
+Created unbound here and initialised in app.py, so modules can import
+socketio without importing the app.
+
+With SOCKETIO_MESSAGE_QUEUE set (e.g. redis://localhost:6379/0), every
+emit to a room is published through the queue and delivered by whichever
+worker holds the recipient's socket, so several gunicorn workers or
+hosts can serve chat. Unset, emits stay in process (single worker).
+More than one worker also needs sticky sessions at the load balancer
+for clients that fall back to long-polling, and the same Redis carries
+the cache invalidations of invalidation.py between workers.
+"""
+import os
+
+from flask_socketio import SocketIO
+
+socketio = SocketIO()
+
+def init_socketio(app):
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        message_queue=os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+    )
+    return socketio
@@ -0,0 +1,144 @@
+"""Feed queries.
+
+Pages trust the denormalized posts.likes_count / posts.comments_count
+counters that like_post and add_comment maintain, so a page is one
+indexed query for the posts plus one batched lookup for user_liked.
+reconcile_counters() periodically corrects any drift in the counters and
+rescores the posts it corrected.
+"""
+import json
+import logging
+import os
+
+import ranking
+import timelines
+from background import PeriodicTask
+from utils import encode_cursor
+
+logger = logging.getLogger('teengram.feed')
+
+FEED_COLUMNS = 'p.*, u.username, u.full_name, u.profile_photo_url'
+
+def load_page(cursor, user_id, feed_type, position=None, limit=20, offset=0, friend_ids=()):
+    """One page of posts as dicts, newest (or hottest) first.
+    
+    friend_ids (the friends feed without timelines) must be resolved by
+    the caller before it checks out the connection behind `cursor`.
+    """
+    if feed_type == 'recommended':
+        # Precomputed hotness order (see ranking.py)
+        posts = ranking.load_page(cursor, position, limit, offset)
+        attach_user_liked(cursor, user_id, posts)
+        return posts
+    
+    if feed_type == 'friends' and timelines.ENABLED:
+        # Precomputed per-user timeline (see timelines.py)
+        posts = timelines.load_page(cursor, user_id, position, limit, offset)
+        attach_user_liked(cursor, user_id, posts)
+        return posts
+    
+    if feed_type == 'friends':
+        # Only posts from friends
+        after = 'AND p.id < ?' if position else ''
+        cursor.execute(f'''
+            SELECT {FEED_COLUMNS}
+            FROM posts p
+            JOIN users u ON u.id = p.user_id
+            WHERE p.user_id IN (SELECT value FROM json_each(?))
+            {after}
+            ORDER BY p.id DESC
+            LIMIT ? OFFSET ?
+        ''', (json.dumps(sorted(friend_ids)), *(position or ()), limit, offset))
+    else:
+        # All posts, newest first
+        after = 'AND p.id < ?' if position else ''
+        cursor.execute(f'''
+            SELECT {FEED_COLUMNS}
+            FROM posts p
+            JOIN users u ON u.id = p.user_id
+            WHERE u.status = 'approved'
+            {after}
+            ORDER BY p.id DESC
+            LIMIT ? OFFSET ?
+        ''', (*(position or ()), limit, offset))
+    
+    posts = [dict(post) for post in cursor.fetchall()]
+    attach_user_liked(cursor, user_id, posts)
+    return posts
+
+def attach_user_liked(cursor, user_id, posts):
+    """Set user_liked on every post with a single IN (...) lookup"""
+    if not posts:
+        return
+    
+    post_ids = [post['id'] for post in posts]
+    placeholders = ','.join('?' * len(post_ids))
+    cursor.execute(
+        f'SELECT post_id FROM likes WHERE user_id = ? AND post_id IN ({placeholders})',
+        (user_id, *post_ids)
+    )
+    liked = {row['post_id'] for row in cursor.fetchall()}
+    
+    for post in posts:
+        post['user_liked'] = 1 if post['id'] in liked else 0
+
+def next_cursor(feed_type, posts, limit):
+    if len(posts) < limit:
+        return None
+    last = posts[-1]
+    if feed_type == 'recommended':
+        return encode_cursor(last['score'], last['id'])
+    return encode_cursor(last['id'])
+
+def reconcile_counters(database, batch_size=1000):
+    """Rewrite likes_count / comments_count where they drifted from the truth.
+    
+    Works through posts in id ranges, one short transaction per range, so
+    it never holds the write lock for long. Corrected posts are rescored in
+    the same transaction. Returns the number of posts fixed.
+    """
+    fixed = 0
+    last_id = 0
+    
+    while True:
+        with database.transaction(immediate=True) as conn:
+            row = conn.execute(
+                'SELECT MAX(id) FROM (SELECT id FROM posts WHERE id > ? ORDER BY id LIMIT ?)',
+                (last_id, batch_size)
+            ).fetchone()
+            upper = row[0]
+            if upper is None:
+                break
+            
+            drifted = [row[0] for row in conn.execute('''
+                SELECT id FROM posts
+                WHERE id > ? AND id <= ?
+                AND (likes_count != (SELECT COUNT(*) FROM likes WHERE post_id = posts.id)
+                     OR comments_count != (SELECT COUNT(*) FROM comments WHERE post_id = posts.id))
+            ''', (last_id, upper))]
+            if drifted:
+                ids = json.dumps(drifted)
+                conn.execute('''
+                    UPDATE posts SET
+                        likes_count = (SELECT COUNT(*) FROM likes WHERE post_id = posts.id),
+                        comments_count = (SELECT COUNT(*) FROM comments WHERE post_id = posts.id)
+                    WHERE id IN (SELECT value FROM json_each(?))
+                ''', (ids,))
+                ranking.rescore(conn, drifted)
+                fixed += len(drifted)
+        last_id = upper
+    
+    if fixed:
+        logger.warning("Reconciled post counters on %d posts", fixed)
+    return fixed
+
+_reconciler = None
+
+def start_reconciler(database):
+    """Run reconcile_counters every FEED_RECONCILE_INTERVAL seconds (0 disables)"""
+    global _reconciler
+    interval = float(os.getenv('FEED_RECONCILE_INTERVAL', 3600))
+    if interval <= 0 or _reconciler is not None:
+        return
+    _reconciler = PeriodicTask('feed-reconcile', interval, lambda: reconcile_counters(database))
+    _reconciler.start()
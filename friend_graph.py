@@ -0,0 +1,108 @@
+"""In-memory friendship adjacency index.
+
+Loaded lazily from the friends table into per-user sets, so friendship
+checks on the chat hot path are a set lookup instead of a query. New
+friendships are added by send_wave and published to the other workers
+(invalidation.py). A periodic reload catches anything missed, and a
+negative are_friends() answer is confirmed against the database before
+a message is refused.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+from database import db
+from invalidation import invalidation_bus
+
+class FriendGraph:
+    def __init__(self, database, reload_interval=300.0):
+        self.db = database
+        self.reload_interval = reload_interval
+        self._adjacency = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._db_confirmations = 0
+    
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.reload_interval:
+            return
+        
+        with self._lock:
+            if self._loaded_at is not loaded_at:
+                return  # another greenlet reloaded meanwhile
+            
+            adjacency = {}
+            with self.db.connection() as conn:
+                for friend_1, friend_2 in conn.execute('SELECT friend_1, friend_2 FROM friends'):
+                    adjacency.setdefault(friend_1, set()).add(friend_2)
+                    adjacency.setdefault(friend_2, set()).add(friend_1)
+            
+            self._adjacency = adjacency
+            self._loaded_at = time.monotonic()
+    
+    def friends_of(self, user_id):
+        self._ensure_loaded()
+        return frozenset(self._adjacency.get(int(user_id), ()))
+    
+    def friend_ids_json(self, user_id):
+        """Friend ids as a JSON array, for `IN (SELECT value FROM json_each(?))`"""
+        return json.dumps(sorted(self.friends_of(user_id)))
+    
+    def are_friends(self, user_a, user_b, confirm=True):
+        user_a, user_b = int(user_a), int(user_b)
+        self._ensure_loaded()
+        self._lookups += 1
+        
+        if user_b in self._adjacency.get(user_a, ()):
+            return True
+        if not confirm:
+            return False
+        
+        # Could be a friendship made by another worker since the last reload
+        self._db_confirmations += 1
+        with self.db.connection() as conn:
+            found = conn.execute(
+                'SELECT 1 FROM friends WHERE friend_1 = ? AND friend_2 = ?',
+                (min(user_a, user_b), max(user_a, user_b))
+            ).fetchone()
+        if found:
+            self._add_edge(user_a, user_b)
+        return found is not None
+    
+    def add_friendship(self, user_a, user_b):
+        self._add_edge(user_a, user_b)
+        invalidation_bus.publish('friendship', int(user_a), int(user_b))
+    
+    def _add_edge(self, user_a, user_b):
+        user_a, user_b = int(user_a), int(user_b)
+        if self._loaded_at is None:
+            return  # picked up by the first load
+        with self._lock:
+            self._adjacency.setdefault(user_a, set()).add(user_b)
+            self._adjacency.setdefault(user_b, set()).add(user_a)
+    
+    def memory_usage(self):
+        """Approximate bytes held by the index (dict, sets and int keys)"""
+        adjacency = self._adjacency
+        total = sys.getsizeof(adjacency)
+        for user_id, friends in adjacency.items():
+            total += sys.getsizeof(user_id) + sys.getsizeof(friends)
+        return total
+    
+    def stats(self):
+        adjacency = self._adjacency
+        return {
+            'loaded': self._loaded_at is not None,
+            'users': len(adjacency),
+            'friendships': sum(len(friends) for friends in adjacency.values()) // 2,
+            'memory_bytes': self.memory_usage(),
+            'lookups': self._lookups,
+            'db_confirmations': self._db_confirmations
+        }
+
+friend_graph = FriendGraph(db, reload_interval=float(os.getenv('FRIEND_GRAPH_RELOAD', 300)))
+invalidation_bus.subscribe('friendship', friend_graph._add_edge)
@@ -0,0 +1,122 @@
+"""Cross-worker invalidation of in-process caches and indexes.
+
+Every worker keeps its own copies of the profile, sender card and ban
+caches, the leaderboard, candidate pools, friend graph and active-story
+index. A writer updates its own copy directly and calls publish(); the
+other workers receive the message over Redis pub/sub and run the handler
+registered for it with subscribe(), so a change made on one worker is
+applied on all of them within a round trip instead of after a TTL or
+reload interval.
+
+The channel lives on CACHE_BUS_URL (defaulting to SOCKETIO_MESSAGE_QUEUE).
+Unset, there is only one worker and publish() does nothing. Running with
+WEB_CONCURRENCY > 1 without a bus logs a warning at startup.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('teengram.invalidation')
+
+class InvalidationBus:
+    def __init__(self, url=None, channel='teengram:invalidate'):
+        self.url = url
+        self.channel = channel
+        self.origin = uuid.uuid4().hex  # skip our own messages
+        self._handlers = {}
+        self._redis = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._published = 0
+        self._received = 0
+        self._failed = 0
+    
+    @property
+    def enabled(self):
+        return self.url is not None
+    
+    def subscribe(self, kind, handler):
+        """Run handler(*args) when another worker publishes `kind`"""
+        self._handlers[kind] = handler
+    
+    def publish(self, kind, *args):
+        if not self.enabled:
+            return
+        self.start()
+        try:
+            self._redis.publish(self.channel, json.dumps({
+                'origin': self.origin,
+                'kind': kind,
+                'args': args
+            }))
+            self._published += 1
+        except Exception:
+            self._failed += 1
+            logger.exception("Could not publish %s invalidation", kind)
+    
+    def start(self):
+        """Connect and start listening (idempotent)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            import redis
+            self._redis = redis.Redis.from_url(self.url)
+            self._thread = threading.Thread(target=self._listen, name='invalidation-bus', daemon=True)
+            self._thread.start()
+    
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self._dispatch(message['data'])
+            except Exception:
+                # Messages sent while disconnected are lost; TTLs and
+                # periodic reloads still bound how stale a copy gets
+                logger.exception("Invalidation bus connection lost; resubscribing")
+                time.sleep(1)
+    
+    def _dispatch(self, data):
+        message = json.loads(data)
+        if message['origin'] == self.origin:
+            return
+        handler = self._handlers.get(message['kind'])
+        if handler is None:
+            return
+        self._received += 1
+        try:
+            handler(*message['args'])
+        except Exception:
+            self._failed += 1
+            logger.exception("Invalidation handler %s failed", message['kind'])
+    
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'kinds': sorted(self._handlers),
+            'published': self._published,
+            'received': self._received,
+            'failed': self._failed
+        }
+
+def _bus_url():
+    url = os.getenv('CACHE_BUS_URL') or os.getenv('SOCKETIO_MESSAGE_QUEUE') or 'memory'
+    if url.startswith(('redis://', 'rediss://')):
+        return url
+    if url == 'memory':
+        return None
+    raise ValueError(f"Unsupported cache bus backend: {url}")
+
+invalidation_bus = InvalidationBus(_bus_url())
+
+if not invalidation_bus.enabled and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+    logger.warning(
+        "WEB_CONCURRENCY > 1 without CACHE_BUS_URL/SOCKETIO_MESSAGE_QUEUE: "
+        "per-worker caches are only refreshed by their TTLs"
+    )
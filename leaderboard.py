@@ -0,0 +1,275 @@
+"""Incrementally maintained leaderboards.
+
+Approved users are kept in an indexable skip list ordered by
+(-points, user_id): insert, remove and rank are O(log n), and a page of
+k entries from any rank is O(log n + k). There is one global board and
+one per college, seeded lazily from users.points and updated by
+award_points and by approval status changes. Other workers re-read a
+user when this worker publishes a change for them (invalidation.py); a
+periodic reload (LEADERBOARD_RELOAD seconds) catches anything missed.
+"""
+import math
+import os
+import random
+import threading
+import time
+
+from database import db
+from invalidation import invalidation_bus
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+    
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+class IndexableSkipList:
+    """Sorted keys with O(log n) insert/remove/rank and positional access.
+    
+    Each link stores how many level-0 steps it skips, which is what makes
+    rank and select logarithmic.
+    """
+    
+    MAX_LEVELS = 32
+    
+    def __init__(self):
+        self.size = 0
+        self.head = _Node(None, self.MAX_LEVELS)
+    
+    def __len__(self):
+        return self.size
+    
+    def _predecessors(self, key):
+        chain = [None] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+    
+    def insert(self, key):
+        chain, steps_at_level = self._predecessors(key)
+        levels = min(self.MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+        node = _Node(key, levels)
+        
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+    
+    def remove(self, key):
+        chain, _ = self._predecessors(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+    
+    def rank(self, key):
+        """0-based position of key"""
+        node = self.head
+        position = 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        return position
+    
+    def slice(self, start, count):
+        """Up to `count` keys starting at 0-based position `start`"""
+        if start < 0 or start >= self.size or count <= 0:
+            return []
+        
+        node = self.head
+        remaining = start + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class Leaderboard:
+    """Ranks user ids by points; ties go to the lower user id"""
+    
+    def __init__(self):
+        self._list = IndexableSkipList()
+        self._keys = {}
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def set(self, user_id, points):
+        old = self._keys.get(user_id)
+        if old is not None:
+            self._list.remove(old)
+        key = (-points, user_id)
+        self._list.insert(key)
+        self._keys[user_id] = key
+    
+    def discard(self, user_id):
+        key = self._keys.pop(user_id, None)
+        if key is not None:
+            self._list.remove(key)
+    
+    def rank(self, user_id):
+        """1-based rank, or None if the user is not on this board"""
+        key = self._keys.get(user_id)
+        return self._list.rank(key) + 1 if key is not None else None
+    
+    def page(self, start_rank, count):
+        """[(rank, user_id, points)] starting at 1-based start_rank"""
+        keys = self._list.slice(start_rank - 1, count)
+        return [(start_rank + i, user_id, -points) for i, (points, user_id) in enumerate(keys)]
+
+class LeaderboardService:
+    def __init__(self, database, reload_interval=300.0):
+        self.db = database
+        self.reload_interval = reload_interval
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._global = Leaderboard()
+        self._colleges = {}
+        self._users = {}
+    
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.reload_interval:
+            return
+        
+        with self._lock:
+            if self._loaded_at is not loaded_at:
+                return
+            
+            with self.db.connection() as conn:
+                rows = conn.execute('''
+                    SELECT id, username, full_name, college_name, points
+                    FROM users WHERE status = 'approved'
+                ''').fetchall()
+            
+            self._global = Leaderboard()
+            self._colleges = {}
+            self._users = {}
+            for row in rows:
+                self._add(dict(row))
+            self._loaded_at = time.monotonic()
+    
+    def _add(self, user):
+        self._users[user['id']] = user
+        self._global.set(user['id'], user['points'])
+        self._colleges.setdefault(user['college_name'], Leaderboard()).set(user['id'], user['points'])
+    
+    def _remove(self, user_id):
+        user = self._users.pop(user_id, None)
+        if user is None:
+            return
+        self._global.discard(user_id)
+        board = self._colleges.get(user['college_name'])
+        if board is not None:
+            board.discard(user_id)
+            if not len(board):
+                del self._colleges[user['college_name']]
+    
+    def _board(self, college):
+        if college is None:
+            return self._global
+        return self._colleges.get(college, Leaderboard())
+    
+    def award(self, user_id, points):
+        """Apply a points delta to an approved user"""
+        if self._loaded_at is not None:
+            with self._lock:
+                user = self._users.get(int(user_id))
+                if user is not None:
+                    user['points'] += points
+                    self._global.set(user['id'], user['points'])
+                    self._colleges[user['college_name']].set(user['id'], user['points'])
+        # Other workers re-read the committed total instead of replaying the delta
+        invalidation_bus.publish('leaderboard', int(user_id))
+    
+    def refresh_user(self, user_id):
+        """Re-read one user, e.g. after approval, rejection or a profile edit"""
+        self._reload_user(user_id)
+        invalidation_bus.publish('leaderboard', int(user_id))
+    
+    def _reload_user(self, user_id):
+        if self._loaded_at is None:
+            return
+        with self.db.connection() as conn:
+            row = conn.execute('''
+                SELECT id, username, full_name, college_name, points
+                FROM users WHERE id = ? AND status = 'approved'
+            ''', (user_id,)).fetchone()
+        with self._lock:
+            self._remove(int(user_id))
+            if row is not None:
+                self._add(dict(row))
+    
+    def _rows(self, entries):
+        rows = []
+        for rank, user_id, points in entries:
+            user = self._users[user_id]
+            rows.append({
+                'username': user['username'],
+                'full_name': user['full_name'],
+                'college_name': user['college_name'],
+                'points': points,
+                'rank': rank
+            })
+        return rows
+    
+    def top(self, limit=50, college=None):
+        self._ensure_loaded()
+        with self._lock:
+            return self._rows(self._board(college).page(1, limit))
+    
+    def rank_of(self, user_id, college=None):
+        self._ensure_loaded()
+        with self._lock:
+            return self._board(college).rank(int(user_id))
+    
+    def around(self, user_id, window=5, college=None):
+        """The user's row with up to `window` neighbours on each side"""
+        self._ensure_loaded()
+        with self._lock:
+            board = self._board(college)
+            rank = board.rank(int(user_id))
+            if rank is None:
+                return None, []
+            start = max(1, rank - window)
+            return rank, self._rows(board.page(start, rank - start + window + 1))
+    
+    def stats(self):
+        return {
+            'loaded': self._loaded_at is not None,
+            'users': len(self._global),
+            'colleges': len(self._colleges)
+        }
+
+leaderboard = LeaderboardService(db, reload_interval=float(os.getenv('LEADERBOARD_RELOAD', 300)))
+invalidation_bus.subscribe('leaderboard', leaderboard._reload_user)
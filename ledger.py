@@ -0,0 +1,153 @@
+"""Buffered points ledger.
+
+With POINTS_LEDGER_MODE=buffered, award_points() queues awards in memory
+instead of writing them on the request path. A background job flushes the
+queue in one transaction: every award becomes a row in points (one
+executemany), and all awards to the same user are merged into a single
+UPDATE of users.points. A flush runs every POINTS_LEDGER_INTERVAL seconds,
+as soon as POINTS_LEDGER_BATCH awards are queued, and once more on a clean
+shutdown.
+
+Durability window: an award is acknowledged before it is written. A crash
+(as opposed to a clean shutdown) loses the awards queued since the last
+flush, i.e. at most POINTS_LEDGER_INTERVAL seconds or POINTS_LEDGER_BATCH
+awards. Points totals also lag by up to that window. The default
+POINTS_LEDGER_MODE=sync keeps the old write-through behaviour.
+"""
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+
+from background import PeriodicTask
+
+logger = logging.getLogger('teengram.ledger')
+
+class PointsLedger:
+    def __init__(self, database, batch_size=200, interval=2.0):
+        self.db = database
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._queue = []
+        self._inflight = []  # batch being written; still pending for has_pending()
+        self._reserved = []  # awards made inside a transaction that has not committed yet
+        self._task = PeriodicTask('points-ledger', interval, self.flush)
+        self._awards_queued = 0
+        self._awards_written = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+    
+    def award(self, user_id, points, reason):
+        self.enqueue(self.reserve(user_id, points, reason))
+    
+    def reserve(self, user_id, points, reason):
+        """Hold an award (visible to has_pending) until enqueue() or release()"""
+        # Keep the award time: the daily login check looks at DATE(created_at)
+        award = (user_id, points, reason, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+        with self._lock:
+            self._reserved.append(award)
+        return award
+    
+    def release(self, award):
+        with self._lock:
+            self._remove_reserved(award)
+    
+    def _remove_reserved(self, award):
+        for i, reserved in enumerate(self._reserved):
+            if reserved is award:
+                del self._reserved[i]
+                return
+    
+    def enqueue(self, award):
+        with self._lock:
+            self._remove_reserved(award)
+            self._queue.append(award)
+            self._awards_queued += 1
+            full = len(self._queue) >= self.batch_size
+        
+        if not self._task.running:
+            self.start()
+        if full:
+            self._task.trigger()
+    
+    def has_pending(self, user_id, reason):
+        with self._lock:
+            return any(a[0] == user_id and a[2] == reason
+                       for a in self._queue + self._inflight + self._reserved)
+    
+    def flush(self):
+        with self._lock:
+            if self._inflight:
+                return 0  # another flush is still writing
+            batch, self._queue = self._queue, []
+            self._inflight = batch
+        if not batch:
+            return 0
+        
+        totals = {}
+        for user_id, points, _, _ in batch:
+            totals[user_id] = totals.get(user_id, 0) + points
+        
+        try:
+            with self.db.transaction(immediate=True) as conn:
+                conn.executemany(
+                    'INSERT INTO points (user_id, points, reason, created_at) VALUES (?, ?, ?, ?)',
+                    batch
+                )
+                conn.executemany(
+                    'UPDATE users SET points = points + ? WHERE id = ?',
+                    [(points, user_id) for user_id, points in totals.items()]
+                )
+        except Exception:
+            # Put the batch back in front of anything queued meanwhile
+            with self._lock:
+                self._queue[:0] = batch
+                self._inflight = []
+                self._failed_flushes += 1
+            logger.exception("Points ledger flush failed; %d awards requeued", len(batch))
+            raise
+        
+        with self._lock:
+            self._inflight = []
+            self._awards_written += len(batch)
+            self._flushes += 1
+        
+        from leaderboard import leaderboard
+        for user_id, points in totals.items():
+            leaderboard.award(user_id, points)
+        return len(batch)
+    
+    def start(self):
+        self._task.start()
+    
+    def drain(self):
+        """Stop the flusher and write everything still queued"""
+        self._task.stop()
+        try:
+            self.flush()
+        except Exception:
+            logger.error("Points ledger drain lost %d awards", len(self._queue))
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._queue),
+                'reserved': len(self._reserved),
+                'awards_queued': self._awards_queued,
+                'awards_written': self._awards_written,
+                'flushes': self._flushes,
+                'failed_flushes': self._failed_flushes
+            }
+
+points_ledger = None
+
+if os.getenv('POINTS_LEDGER_MODE', 'sync') == 'buffered':
+    from database import db
+    points_ledger = PointsLedger(
+        db,
+        batch_size=int(os.getenv('POINTS_LEDGER_BATCH', 200)),
+        interval=float(os.getenv('POINTS_LEDGER_INTERVAL', 2))
+    )
+    atexit.register(points_ledger.drain)
@@ -0,0 +1,105 @@
+"""Maintenance commands.
+
+    python manage.py migrate [--target N]
+    python manage.py migrate --status
+    python manage.py rebuild-conversations
+    python manage.py reconcile-counters
+    python manage.py refresh-rankings
+    python manage.py rebuild-timelines
+    python manage.py sweep-stories [--archive]
+"""
+import argparse
+import sqlite3
+
+import conversations
+import feed
+import migrations
+import ranking
+import timelines
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def cmd_migrate(args):
+    conn = connect(args.db)
+    
+    if args.status:
+        print(f"Current schema version: {migrations.current_version(conn)}")
+        for version, name, _ in migrations.pending_migrations(conn):
+            print(f"  pending {version}: {name}")
+    else:
+        applied = migrations.migrate(conn, target=args.target)
+        if applied:
+            print(f"Applied migrations: {', '.join(map(str, applied))}")
+        else:
+            print("Database is up to date")
+    
+    conn.close()
+
+def cmd_rebuild_conversations(args):
+    conn = connect(args.db)
+    conversations.rebuild(conn)
+    conn.commit()
+    count = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+    print(f"Rebuilt {count} conversation summaries")
+    conn.close()
+
+def cmd_reconcile_counters(args):
+    from database import Database
+    fixed = feed.reconcile_counters(Database(args.db))
+    print(f"Fixed counters on {fixed} posts")
+
+def cmd_refresh_rankings(args):
+    from database import Database
+    ranking.refresh(Database(args.db))
+    print("Recomputed post rankings")
+
+def cmd_rebuild_timelines(args):
+    conn = connect(args.db)
+    timelines.rebuild(conn)
+    conn.commit()
+    count = conn.execute('SELECT COUNT(*) FROM timelines').fetchone()[0]
+    print(f"Rebuilt timelines with {count} entries")
+    conn.close()
+
+def cmd_sweep_stories(args):
+    # stories loads the app's database singleton; import it only when needed
+    import stories
+    from database import Database
+    mode = 'archive' if args.archive else stories.EXPIRY_MODE
+    swept = stories.sweep(Database(args.db), mode=mode)
+    print(f"Removed {swept} expired stories ({mode})")
+
+def main():
+    parser = argparse.ArgumentParser(description='Teengram maintenance commands')
+    parser.add_argument('--db', default='teengram.db', help='Path to the SQLite database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    migrate_parser = commands.add_parser('migrate', help='Apply pending schema migrations')
+    migrate_parser.add_argument('--target', type=int, help='Stop after this version')
+    migrate_parser.add_argument('--status', action='store_true', help='Show version and pending migrations')
+    migrate_parser.set_defaults(func=cmd_migrate)
+    
+    rebuild_parser = commands.add_parser('rebuild-conversations', help='Backfill conversation summaries')
+    rebuild_parser.set_defaults(func=cmd_rebuild_conversations)
+    
+    reconcile_parser = commands.add_parser('reconcile-counters', help='Fix drifted post like/comment counters')
+    reconcile_parser.set_defaults(func=cmd_reconcile_counters)
+    
+    rankings_parser = commands.add_parser('refresh-rankings', help='Recompute recommended feed scores')
+    rankings_parser.set_defaults(func=cmd_refresh_rankings)
+    
+    timelines_parser = commands.add_parser('rebuild-timelines', help='Recompute friend timelines')
+    timelines_parser.set_defaults(func=cmd_rebuild_timelines)
+    
+    sweep_parser = commands.add_parser('sweep-stories', help='Remove expired stories')
+    sweep_parser.add_argument('--archive', action='store_true', help='Copy them to stories_archive first')
+    sweep_parser.set_defaults(func=cmd_sweep_stories)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Chat message send path.
+
+insert_message() builds the outgoing payload from the values it just
+inserted plus the sender's cached "card" (username and photo), so a send
+is a single INSERT with no follow-up read. On SQLite 3.35+ the INSERT
+returns the stored row with RETURNING; older libraries fall back to
+lastrowid and a Python-side timestamp in CURRENT_TIMESTAMP format.
+"""
+import sqlite3
+from datetime import datetime
+
+from cache import sender_card_cache
+
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def sender_card(cursor, user_id):
+    card = sender_card_cache.get(user_id)
+    if card is None:
+        cursor.execute('SELECT username, profile_photo_url FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+        card = {
+            'username': row['username'] if row else None,
+            'profile_photo_url': row['profile_photo_url'] if row else None
+        }
+        sender_card_cache.set(user_id, card)
+    return card
+
+def insert_message(cursor, sender_id, receiver_id, text=None, file_url=None):
+    """Insert a message and return it as sent to clients (m.* plus sender card)"""
+    card = sender_card(cursor, sender_id)
+    
+    if HAS_RETURNING:
+        cursor.execute('''
+            INSERT INTO messages (sender_id, receiver_id, text, file_url)
+            VALUES (?, ?, ?, ?)
+            RETURNING *
+        ''', (sender_id, receiver_id, text, file_url))
+        # Drain the statement so the following commit is not blocked by it
+        message = dict(cursor.fetchall()[0])
+    else:
+        cursor.execute('''
+            INSERT INTO messages (sender_id, receiver_id, text, file_url)
+            VALUES (?, ?, ?, ?)
+        ''', (sender_id, receiver_id, text, file_url))
+        message = {
+            'id': cursor.lastrowid,
+            'sender_id': int(sender_id),
+            'receiver_id': int(receiver_id),
+            'text': text,
+            'file_url': file_url,
+            'is_seen': 0,
+            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    message.update(card)
+    return message
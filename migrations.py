@@ -0,0 +1,213 @@
+"""Versioned schema migrations.
+
+init_database creates the base tables; everything added after that lives
+here as an ordered, numbered migration. Applied versions are recorded in
+schema_version so each migration runs exactly once per database.
+
+A migration step is either an SQL string or a callable taking the
+connection. Never edit a migration that has shipped - add a new one.
+"""
+import conversations
+import ranking
+import search
+import timelines
+
+MIGRATIONS = [
+    (1, 'Hot path secondary indexes', [
+        # Chat history and inbox (both directions of a pair)
+        'CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages (sender_id, receiver_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages (receiver_id, sender_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages (receiver_id, sender_id) WHERE is_seen = 0',
+        # Feed, comments and likes (likes(post_id) is covered by UNIQUE(post_id, user_id))
+        'CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_user_created ON posts (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_post_created ON comments (post_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_likes_user ON likes (user_id)',
+        # Friends are stored once per pair, so lookups by the second column need their own index
+        'CREATE INDEX IF NOT EXISTS idx_friends_friend_2 ON friends (friend_2)',
+        # Stories tray
+        'CREATE INDEX IF NOT EXISTS idx_stories_expires ON stories (expires_at)',
+        'CREATE INDEX IF NOT EXISTS idx_stories_user_expires ON stories (user_id, expires_at)',
+        # Login path
+        'CREATE INDEX IF NOT EXISTS idx_points_user_reason ON points (user_id, reason, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_bans_user ON bans (user_id, ban_start)',
+        'CREATE INDEX IF NOT EXISTS idx_device_ids_fingerprint ON device_ids (device_fingerprint)',
+        # Admin queues
+        'CREATE INDEX IF NOT EXISTS idx_users_status_created ON users (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_reports_status_created ON reports (status, created_at)'
+    ]),
+    (2, 'Conversation summaries', [
+        '''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_low INTEGER NOT NULL,
+            user_high INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_message_text TEXT,
+            last_message_at TIMESTAMP,
+            last_sender_id INTEGER,
+            unread_low INTEGER NOT NULL DEFAULT 0,
+            unread_high INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_low, user_high)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_low ON conversations (user_low, last_message_id)',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_high ON conversations (user_high, last_message_id)',
+        # unread_low counts messages user_low has not read, i.e. sent by user_high
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_messages_conversation AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO conversations (user_low, user_high, last_message_id, last_message_text,
+                                       last_message_at, last_sender_id, unread_low, unread_high)
+            VALUES (
+                MIN(NEW.sender_id, NEW.receiver_id), MAX(NEW.sender_id, NEW.receiver_id),
+                NEW.id, NEW.text, NEW.created_at, NEW.sender_id,
+                NEW.sender_id > NEW.receiver_id, NEW.sender_id < NEW.receiver_id
+            )
+            ON CONFLICT (user_low, user_high) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                last_message_text = excluded.last_message_text,
+                last_message_at = excluded.last_message_at,
+                last_sender_id = excluded.last_sender_id,
+                unread_low = unread_low + excluded.unread_low,
+                unread_high = unread_high + excluded.unread_high;
+        END
+        ''',
+        conversations.rebuild
+    ]),
+    (3, 'Keyset pagination indexes', [
+        # Serve ORDER BY id within the leading columns without a sort
+        'CREATE INDEX IF NOT EXISTS idx_messages_pair_id ON messages (sender_id, receiver_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments (post_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_likes ON posts (likes_count, id)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts (user_id, id)'
+    ]),
+    (4, 'Recommended feed ranking', [
+        '''
+        CREATE TABLE IF NOT EXISTS post_rankings (
+            post_id INTEGER PRIMARY KEY,
+            score REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (post_id) REFERENCES posts (id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_post_rankings_score ON post_rankings (score, post_id)',
+        ranking.backfill
+    ]),
+    (5, 'Friend timelines', [
+        '''
+        CREATE TABLE IF NOT EXISTS timelines (
+            owner_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            PRIMARY KEY (owner_id, post_id)
+        ) WITHOUT ROWID
+        ''',
+        timelines.rebuild
+    ]),
+    (6, 'Full-text user search', [
+        search.create_index
+    ]),
+    (7, 'Story archive', [
+        '''
+        CREATE TABLE IF NOT EXISTS stories_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            file_url TEXT NOT NULL,
+            view_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_stories_archive_user ON stories_archive (user_id, id)'
+    ]),
+    (8, 'Story viewers', [
+        '''
+        CREATE TABLE IF NOT EXISTS story_views (
+            story_id INTEGER NOT NULL,
+            viewer_id INTEGER NOT NULL,
+            viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (story_id, viewer_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_story_views_recent ON story_views (story_id, viewed_at)'
+    ]),
+    (9, 'Read watermarks', [
+        '''
+        CREATE TABLE IF NOT EXISTS read_watermarks (
+            reader_id INTEGER NOT NULL,
+            other_user_id INTEGER NOT NULL,
+            last_read_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (reader_id, other_user_id)
+        ) WITHOUT ROWID
+        ''',
+        conversations.backfill_watermarks,
+        # Unread counters now come from watermarks; is_seen is no longer maintained
+        conversations.rebuild,
+        'DROP INDEX IF EXISTS idx_messages_unread'
+    ]),
+    (10, 'Story expiry in UTC', [
+        # create_story used to write local time; stories are now compared and
+        # swept against CURRENT_TIMESTAMP (UTC)
+        "UPDATE stories SET expires_at = datetime(expires_at, 'utc')"
+    ]),
+]
+
+def ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def applied_versions(conn):
+    ensure_version_table(conn)
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+def current_version(conn):
+    versions = applied_versions(conn)
+    return max(versions) if versions else 0
+
+def pending_migrations(conn):
+    applied = applied_versions(conn)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order, each in its own transaction.
+
+    Safe to run concurrently from several workers: the version check is
+    repeated after taking the write lock. Returns the versions applied.
+    """
+    applied_now = []
+
+    for version, name, steps in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if target is not None and version > target:
+            break
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version in applied_versions(conn):
+                conn.rollback()
+                continue
+
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+
+            conn.execute(
+                'INSERT INTO schema_version (version, name) VALUES (?, ?)',
+                (version, name)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        applied_now.append(version)
+
+    return applied_now
@@ -0,0 +1,142 @@
+"""Presence: who is online, last seen, and friend notifications.
+
+Built on the socket_state store, so every lookup is in memory (or one
+Redis round trip) and never touches SQLite. A user is online while they
+have at least one socket; several tabs are several sids. Engine.IO's
+own ping/pong disconnects dead sockets, so every socket this worker
+still holds is alive: the worker renews their heartbeats every
+PRESENCE_TIMEOUT / 3 seconds, and clients need not send anything
+(an explicit `heartbeat` event is still accepted). Sockets that miss
+heartbeats for PRESENCE_TIMEOUT seconds belong to a worker that died
+without disconnecting them, and are expired.
+
+Online/offline transitions are not pushed immediately: they are
+collected and sent to the user's online friends at most once per
+PRESENCE_BROADCAST_INTERVAL, and a flap (a tab reload) that ends in the
+state last broadcast sends nothing.
+"""
+import os
+import threading
+import time
+
+from background import PeriodicTask
+from friend_graph import friend_graph
+from socket_state import socket_state
+
+class PresenceService:
+    def __init__(self, store, broadcast_interval=2.0, timeout=90.0):
+        self.store = store
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._changed = set()
+        self._local = {}  # sid -> user_id for sockets held by this worker
+        self._broadcast_state = {}  # user_id -> online as last broadcast
+        self._last_expiry = time.monotonic()
+        self._task = PeriodicTask('presence', broadcast_interval, self.tick)
+        self._broadcasts = 0
+        self._suppressed = 0
+        self._expired = 0
+    
+    def connected(self, sid, user_id):
+        self.store.connect(sid, user_id)
+        self._local[sid] = user_id
+        self._mark_changed(user_id)
+    
+    def disconnected(self, sid):
+        self._local.pop(sid, None)
+        user_id = self.store.disconnect(sid)
+        if user_id is not None:
+            self._mark_changed(user_id)
+        return user_id
+    
+    def heartbeat(self, sid):
+        self.store.heartbeat(sid)
+    
+    def is_online(self, user_id):
+        return self.store.is_online(user_id)
+    
+    def online_friends(self, user_id):
+        return self.store.online_among(friend_graph.friends_of(user_id))
+    
+    def annotate(self, rows, key='id'):
+        """Add is_online and last_seen (unix time) to dict rows, in one bulk lookup"""
+        user_ids = [row[key] for row in rows]
+        online = self.store.online_among(user_ids)
+        last_seen = self.store.last_seen(user_ids)
+        for row in rows:
+            row['is_online'] = row[key] in online
+            row['last_seen'] = last_seen.get(row[key])
+        return rows
+    
+    def _mark_changed(self, user_id):
+        with self._lock:
+            self._changed.add(user_id)
+        if not self._task.running:
+            self._task.start()
+    
+    def keep_alive(self):
+        """Renew the heartbeats of every socket this worker holds"""
+        sockets = list(self._local.items())
+        if sockets:
+            self.store.touch(sockets)
+        return len(sockets)
+    
+    def expire_stale(self):
+        """Drop sockets whose heartbeats stopped; returns how many"""
+        stale = self.store.stale_sids(self.timeout)
+        for sid in stale:
+            self.disconnected(sid)
+        self._expired += len(stale)
+        return len(stale)
+    
+    def tick(self):
+        if time.monotonic() - self._last_expiry >= self.timeout / 3:
+            self._last_expiry = time.monotonic()
+            self.keep_alive()
+            self.expire_stale()
+        self.broadcast_changes()
+    
+    def broadcast_changes(self):
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        if not changed:
+            return 0
+        
+        from extensions import socketio
+        
+        sent = 0
+        online = self.store.online_among(changed)
+        for user_id in changed:
+            is_online = user_id in online
+            if self._broadcast_state.get(user_id, False) == is_online:
+                self._suppressed += 1
+                continue
+            if is_online:
+                self._broadcast_state[user_id] = True
+            else:
+                self._broadcast_state.pop(user_id, None)
+            
+            payload = {'user_id': user_id, 'online': is_online, 'last_seen': time.time()}
+            for friend_id in self.online_friends(user_id):
+                socketio.emit('presence', payload, room=f"user_{friend_id}")
+            sent += 1
+        
+        self._broadcasts += sent
+        return sent
+    
+    def stats(self):
+        return dict(
+            self.store.stats(),
+            timeout=self.timeout,
+            local_sockets=len(self._local),
+            pending_changes=len(self._changed),
+            broadcasts=self._broadcasts,
+            suppressed=self._suppressed,
+            expired_sockets=self._expired
+        )
+
+presence = PresenceService(
+    socket_state,
+    broadcast_interval=float(os.getenv('PRESENCE_BROADCAST_INTERVAL', 2)),
+    timeout=float(os.getenv('PRESENCE_TIMEOUT', 90))
+)
@@ -0,0 +1,195 @@
+"""SQL instrumentation for pooled connections.
+
+Every statement run through a pooled connection is recorded under its
+normalized text with call count, latency histogram and rows returned,
+attributed to the Flask endpoint or Socket.IO event that issued it.
+Statements slower than the threshold are logged with their query plan.
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('teengram.sql')
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open ended
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_sql(sql):
+    """Collapse whitespace and literals so identical statements share one entry"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('(?...)', sql)
+
+def current_source():
+    """Name of the Flask endpoint or Socket.IO event running in this context"""
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return 'background'
+
+    if not has_request_context():
+        return 'background'
+
+    event = getattr(request, 'event', None)
+    if event:
+        return f"socket:{event.get('message')}"
+    return request.endpoint or request.path
+
+class QueryStats:
+    def __init__(self, slow_ms=100.0, max_statements=500, slow_log_size=50):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._slow = deque(maxlen=slow_log_size)
+
+    def record(self, sql, duration_ms, rows=0, source=None):
+        key = normalize_sql(sql)
+        bucket = next(
+            (i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if duration_ms <= bound),
+            len(HISTOGRAM_BUCKETS_MS)
+        )
+
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                if len(self._statements) >= self.max_statements:
+                    return key
+                entry = self._statements[key] = {
+                    'statement': key,
+                    'calls': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'histogram': [0] * (len(HISTOGRAM_BUCKETS_MS) + 1),
+                    'sources': {}
+                }
+            entry['calls'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['rows'] += rows
+            entry['histogram'][bucket] += 1
+            entry['sources'][source] = entry['sources'].get(source, 0) + 1
+
+        return key
+
+    def add_rows(self, key, rows):
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is not None:
+                entry['rows'] += rows
+
+    def record_slow(self, sql, duration_ms, source, plan):
+        self._slow.append({
+            'statement': normalize_sql(sql),
+            'duration_ms': round(duration_ms, 2),
+            'source': source,
+            'plan': plan,
+            'at': time.time()
+        })
+        logger.warning(
+            "Slow query (%.1fms) from %s: %s\n%s",
+            duration_ms, source, normalize_sql(sql), '\n'.join(plan)
+        )
+
+    def snapshot(self, limit=50, sort='total_ms'):
+        with self._lock:
+            entries = [dict(entry, sources=dict(entry['sources']), histogram=list(entry['histogram']))
+                       for entry in self._statements.values()]
+            slow = list(self._slow)
+
+        for entry in entries:
+            entry['avg_ms'] = round(entry['total_ms'] / entry['calls'], 3) if entry['calls'] else 0
+            entry['total_ms'] = round(entry['total_ms'], 3)
+            entry['max_ms'] = round(entry['max_ms'], 3)
+        entries.sort(key=lambda e: e.get(sort, 0), reverse=True)
+
+        return {
+            'slow_threshold_ms': self.slow_ms,
+            'histogram_buckets_ms': list(HISTOGRAM_BUCKETS_MS),
+            'statements': entries[:limit],
+            'slow_queries': slow
+        }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute() and counts fetched rows"""
+
+    def __init__(self, cursor, stats, executor=None):
+        self._cursor = cursor
+        self._stats = stats
+        self._executor = executor  # runs the EXPLAIN off the hub, like the query itself
+        self._key = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._count(1)
+            yield row
+
+    def _count(self, rows):
+        if self._key is not None and rows:
+            self._stats.add_rows(self._key, rows)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(self._cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(self._cursor.executemany, sql, seq_of_parameters, explain=False)
+
+    def _timed(self, method, sql, parameters, explain=True):
+        source = current_source()
+        start = time.perf_counter()
+        try:
+            method(sql, parameters)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            # rowcount covers INSERT/UPDATE/DELETE; SELECT rows are added as they are fetched
+            rows = max(self._cursor.rowcount, 0)
+            self._key = self._stats.record(sql, duration_ms, rows, source)
+
+        if explain and duration_ms >= self._stats.slow_ms:
+            self._stats.record_slow(sql, duration_ms, source, self._plan(sql, parameters))
+        return self
+
+    def _plan(self, sql, parameters):
+        try:
+            if self._executor is not None:
+                rows = self._executor.run(self._explain, sql, parameters)
+            else:
+                rows = self._explain(sql, parameters)
+            return [row[-1] for row in rows]
+        except Exception as e:
+            return [f'(no plan: {e})']
+
+    def _explain(self, sql, parameters):
+        return self._cursor.connection.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._count(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
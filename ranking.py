@@ -0,0 +1,107 @@
+"""Hotness ranking for the recommended feed.
+
+score = log10(max(1, likes + 2 * comments)) + created_epoch / DECAY_SECONDS
+
+The time term grows with post age instead of shrinking, so scores never
+need re-decaying: a post needs 10x the engagement to outrank one posted
+DECAY_SECONDS later. Scores live in post_rankings and are updated in the
+same transaction as the like/comment that changes them; when the
+counter reconciler (feed.reconcile_counters) corrects a post, it
+rescores just that post. `manage.py refresh-rankings` recomputes all.
+"""
+import json
+import math
+from datetime import datetime, timezone
+
+DECAY_SECONDS = 45000  # 12.5 hours
+COMMENT_WEIGHT = 2
+
+def hot_score(likes, comments, created_at):
+    engagement = max(1, (likes or 0) + COMMENT_WEIGHT * (comments or 0))
+    return round(math.log10(engagement) + _epoch(created_at) / DECAY_SECONDS, 7)
+
+def _epoch(created_at):
+    # CURRENT_TIMESTAMP values are UTC 'YYYY-MM-DD HH:MM:SS'
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    if created_at is None:
+        created_at = datetime.now(timezone.utc)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+def update_post(cursor, post_id):
+    """Recompute one post's score from its current counters"""
+    cursor.execute(
+        'SELECT id, likes_count, comments_count, created_at FROM posts WHERE id = ?',
+        (post_id,)
+    )
+    post = cursor.fetchone()
+    if post is None:
+        return
+    _upsert(cursor, [post])
+
+def _upsert(cursor, posts):
+    cursor.executemany('''
+        INSERT INTO post_rankings (post_id, score, updated_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (post_id) DO UPDATE SET
+            score = excluded.score,
+            updated_at = excluded.updated_at
+    ''', [
+        (post['id'], hot_score(post['likes_count'], post['comments_count'], post['created_at']))
+        for post in posts
+    ])
+
+def rescore(conn, post_ids):
+    """Recompute the scores of the given posts"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, likes_count, comments_count, created_at FROM posts
+        WHERE id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(post_ids)),))
+    _upsert(cursor, cursor.fetchall())
+
+def refresh_range(conn, after_id, batch_size):
+    """Rescore up to batch_size posts with id > after_id; returns the last id seen"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, likes_count, comments_count, created_at FROM posts
+        WHERE id > ? ORDER BY id LIMIT ?
+    ''', (after_id, batch_size))
+    posts = cursor.fetchall()
+    if not posts:
+        return None
+    _upsert(cursor, posts)
+    return posts[-1]['id']
+
+def backfill(conn):
+    last_id = 0
+    while last_id is not None:
+        last_id = refresh_range(conn, last_id, 1000)
+
+def refresh(database, batch_size=1000):
+    """Rescore every post, one short transaction per batch"""
+    last_id = 0
+    while True:
+        with database.transaction(immediate=True) as conn:
+            last_id = refresh_range(conn, last_id, batch_size)
+        if last_id is None:
+            break
+
+def load_page(cursor, position=None, limit=20, offset=0):
+    from feed import FEED_COLUMNS
+    
+    after = 'AND (r.score < ? OR (r.score = ? AND r.post_id < ?))' if position else ''
+    params = (position[0], position[0], position[1]) if position else ()
+    cursor.execute(f'''
+        SELECT {FEED_COLUMNS}, r.score
+        FROM post_rankings r
+        JOIN posts p ON p.id = r.post_id
+        JOIN users u ON u.id = p.user_id
+        WHERE u.status = 'approved'
+        {after}
+        ORDER BY r.score DESC, r.post_id DESC
+        LIMIT ? OFFSET ?
+    ''', (*params, limit, offset))
+    return [dict(post) for post in cursor.fetchall()]
@@ -1,6 +1,15 @@
 from flask import Blueprint, request, jsonify, session
 import bcrypt
 from database import db
+from cache import profile_cache, ban_cache, sender_card_cache, invalidate_profile, invalidate_ban
+from friend_graph import friend_graph
+from leaderboard import leaderboard
+from candidates import candidate_pools
+import stories
+from story_views import story_views
+from presence import presence
+from typing_indicators import typing_indicators
+from invalidation import invalidation_bus
 from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
@@ -69,12 +78,53 @@ def dashboard():
                 "approved_users": approved_users,
                 "total_posts": total_posts,
                 "pending_reports": pending_reports
+            },
+            "database": {
+                "pool": db.pool_stats(),
+                "profile": db.describe_profile()
             }
         }), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@admin_bp.route('/db-stats')
+@require_admin
+def db_stats():
+    try:
+        if db.query_stats is None:
+            return jsonify({"error": "Query statistics are disabled"}), 404
+        
+        limit = int(request.args.get('limit', 50))
+        sort = request.args.get('sort', 'total_ms')  # total_ms, avg_ms, max_ms, calls, rows
+        
+        from ledger import points_ledger
+        
+        return jsonify({
+            "pool": db.pool_stats(),
+            "caches": [profile_cache.stats(), ban_cache.stats(), sender_card_cache.stats()],
+            "invalidation": invalidation_bus.stats(),
+            "friend_graph": friend_graph.stats(),
+            "leaderboard": leaderboard.stats(),
+            "candidate_pools": candidate_pools.stats(),
+            "stories": stories.stats(),
+            "story_views": story_views.stats(),
+            "presence": presence.stats(),
+            "typing": typing_indicators.stats(),
+            "points_ledger": points_ledger.stats() if points_ledger is not None else None,
+            "queries": db.query_stats.snapshot(limit=limit, sort=sort)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/db-stats/reset', methods=['POST'])
+@require_admin
+def reset_db_stats():
+    if db.query_stats is not None:
+        db.query_stats.reset()
+    return jsonify({"message": "Query statistics reset"}), 200
+
 @admin_bp.route('/pending-users')
 @require_admin
 def get_pending_users():
@@ -120,6 +170,9 @@ def approve_user():
         
         conn.commit()
         conn.close()
+        invalidate_profile(user_id)
+        leaderboard.refresh_user(user_id)
+        candidate_pools.refresh_user(user_id)
         
         return jsonify({"message": "User approved successfully"}), 200
         
@@ -146,6 +199,9 @@ def reject_user():
         
         conn.commit()
         conn.close()
+        invalidate_profile(user_id)
+        leaderboard.refresh_user(user_id)
+        candidate_pools.refresh_user(user_id)
         
         return jsonify({"message": "User rejected successfully"}), 200
         
@@ -209,13 +265,14 @@ def ban_user():
             else:
                 return jsonify({"error": "Invalid duration"}), 400
         
-                cursor.execute('''
+        cursor.execute('''
             INSERT INTO bans (user_id, reason, ban_end, is_permanent)
             VALUES (?, ?, ?, ?)
         ''', (user_id, reason, ban_end, is_permanent))
         
         conn.commit()
         conn.close()
+        invalidate_ban(user_id)
         
         return jsonify({"message": "User banned successfully"}), 200
         
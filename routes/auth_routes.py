@@ -5,6 +5,7 @@ import bcrypt
 import cloudinary.uploader
 from database import db
 from utils import generate_teengram_number, generate_device_fingerprint, check_ban_status
+from cache import invalidate_profile
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -15,7 +16,7 @@ def signup():
         
         # Validate required fields
         required_fields = ['username', 'full_name', 'password', 'age', 'city', 'gender', 'college_name']
-                for field in required_fields:
+        for field in required_fields:
             if field not in data or not data[field]:
                 return jsonify({"error": f"{field} is required"}), 400
         
@@ -95,12 +96,9 @@ def login():
         if not username or not password:
             return jsonify({"error": "Username and password required"}), 400
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Get user
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
+        # Read and verify without holding a connection through bcrypt
+        with db.connection() as conn:
+            user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
         
         if not user:
             return jsonify({"error": "Invalid credentials"}), 401
@@ -127,25 +125,31 @@ def login():
                     "ban_end": ban_status['ban_end']
                 }), 403
         
-        # Update last login
-        cursor.execute(
-            'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?',
-            (user['id'],)
-        )
-        
-        # Award daily login points
-        cursor.execute('''
-            SELECT COUNT(*) FROM points 
-            WHERE user_id = ? AND reason = 'Daily login' 
-            AND DATE(created_at) = DATE('now')
-        ''', (user['id'],))
-        
-        if cursor.fetchone()[0] == 0:
-            from utils import award_points
-            award_points(user['id'], 1, 'Daily login')
-        
-        conn.commit()
-        conn.close()
+        # Write last login and daily points in one transaction
+        with db.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            
+            # Update last login
+            cursor.execute(
+                'UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?',
+                (user['id'],)
+            )
+            
+            # Award daily login points
+            cursor.execute('''
+                SELECT COUNT(*) FROM points 
+                WHERE user_id = ? AND reason = 'Daily login' 
+                AND DATE(created_at) = DATE('now')
+            ''', (user['id'],))
+            
+            from ledger import points_ledger
+            already_awarded = cursor.fetchone()[0] > 0 or (
+                points_ledger is not None and points_ledger.has_pending(user['id'], 'Daily login')
+            )
+            
+            if not already_awarded:
+                from utils import award_points
+                award_points(user['id'], 1, 'Daily login')
         
         # Create session
         session['user_id'] = user['id']
@@ -239,6 +243,7 @@ def upload_profile_photo():
         )
         conn.commit()
         conn.close()
+        invalidate_profile(user_id)
         
         return jsonify({
             "message": "Profile photo uploaded successfully",
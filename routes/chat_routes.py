@@ -1,6 +1,11 @@
 from flask import Blueprint, request, jsonify, session
 import cloudinary.uploader
 from database import db
+from conversations import mark_read, with_seen_state
+from utils import page_limit
+from friend_graph import friend_graph
+from messaging import insert_message
+from presence import presence
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -21,38 +26,30 @@ def get_conversations():
         conn = db.get_connection()
         cursor = conn.cursor()
         
+        # One indexed read of the materialized summaries (see conversations.py)
         cursor.execute('''
-            SELECT DISTINCT
-                CASE 
-                    WHEN m.sender_id = ? THEN m.receiver_id
-                    ELSE m.sender_id
-                END as other_user_id,
-                u.username, u.full_name, u.profile_photo_url,
-                (SELECT text FROM messages m2 
-                 WHERE (m2.sender_id = ? AND m2.receiver_id = other_user_id)
-                    OR (m2.receiver_id = ? AND m2.sender_id = other_user_id)
-                 ORDER BY m2.created_at DESC LIMIT 1) as last_message,
-                (SELECT created_at FROM messages m2 
-                 WHERE (m2.sender_id = ? AND m2.receiver_id = other_user_id)
-                    OR (m2.receiver_id = ? AND m2.sender_id = other_user_id)
-                 ORDER BY m2.created_at DESC LIMIT 1) as last_message_time,
-                (SELECT COUNT(*) FROM messages m2 
-                 WHERE m2.sender_id = other_user_id AND m2.receiver_id = ? 
-                 AND m2.is_seen = 0) as unread_count
-            FROM messages m
-            JOIN users u ON u.id = CASE 
-                WHEN m.sender_id = ? THEN m.receiver_id
-                ELSE m.sender_id
-            END
-            WHERE m.sender_id = ? OR m.receiver_id = ?
-            ORDER BY last_message_time DESC
-        ''', (user_id, user_id, user_id, user_id, user_id, user_id, user_id, user_id, user_id))
-        
-        conversations = cursor.fetchall()
+            SELECT c.other_user_id, u.username, u.full_name, u.profile_photo_url,
+                   c.last_message, c.last_message_time, c.unread_count
+            FROM (
+                SELECT user_high as other_user_id, last_message_id,
+                       last_message_text as last_message, last_message_at as last_message_time,
+                       unread_low as unread_count
+                FROM conversations WHERE user_low = ?
+                UNION ALL
+                SELECT user_low, last_message_id,
+                       last_message_text, last_message_at,
+                       unread_high
+                FROM conversations WHERE user_high = ?
+            ) c
+            JOIN users u ON u.id = c.other_user_id
+            ORDER BY c.last_message_id DESC
+        ''', (user_id, user_id))
+        
+        conversations = [dict(conv) for conv in cursor.fetchall()]
         conn.close()
         
         return jsonify({
-            "conversations": [dict(conv) for conv in conversations]
+            "conversations": presence.annotate(conversations, key='other_user_id')
         }), 200
         
     except Exception as e:
@@ -63,36 +60,72 @@ def get_conversations():
 def get_messages(other_user_id):
     try:
         user_id = session['user_id']
+        limit = page_limit(request.args, 50, 100)
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
         page = int(request.args.get('page', 1))
-        limit = 50
-        offset = (page - 1) * limit
         
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        # Mark messages as seen
-        cursor.execute(
-            'UPDATE messages SET is_seen = 1 WHERE sender_id = ? AND receiver_id = ?',
-            (other_user_id, user_id)
-        )
-        
-        # Get messages
-        cursor.execute('''
-            SELECT m.*, u.username, u.profile_photo_url
-            FROM messages m
-            JOIN users u ON u.id = m.sender_id
-            WHERE (m.sender_id = ? AND m.receiver_id = ?)
-               OR (m.sender_id = ? AND m.receiver_id = ?)
-            ORDER BY m.created_at DESC
-            LIMIT ? OFFSET ?
-        ''', (user_id, other_user_id, other_user_id, user_id, limit, offset))
-        
-        messages = cursor.fetchall()
+        # Mark messages as seen: advances this user's read watermark
+        mark_read(cursor, user_id, other_user_id)
+        
+        if before_id is None and after_id is None and page > 1:
+            # Legacy offset paging; clients should follow before_id instead
+            cursor.execute('''
+                SELECT m.*, u.username, u.profile_photo_url
+                FROM messages m
+                JOIN users u ON u.id = m.sender_id
+                WHERE (m.sender_id = ? AND m.receiver_id = ?)
+                   OR (m.sender_id = ? AND m.receiver_id = ?)
+                ORDER BY m.id DESC
+                LIMIT ? OFFSET ?
+            ''', (user_id, other_user_id, other_user_id, user_id, limit, (page - 1) * limit))
+            messages = list(reversed(cursor.fetchall()))
+        else:
+            # Keyset paging: each direction of the pair is an index range
+            # on (sender_id, receiver_id, id), merged and cut to one page
+            if after_id is not None:
+                condition, order, bound = 'id > ?', 'ASC', after_id
+            else:
+                # No cursor means the newest page
+                condition, order = 'id < ?', 'DESC'
+                bound = before_id if before_id is not None else 2 ** 63 - 1
+            
+            cursor.execute(f'''
+                SELECT m.*, u.username, u.profile_photo_url
+                FROM (
+                    SELECT * FROM (
+                        SELECT * FROM messages
+                        WHERE sender_id = ? AND receiver_id = ? AND {condition}
+                        ORDER BY id {order} LIMIT ?
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT * FROM messages
+                        WHERE sender_id = ? AND receiver_id = ? AND {condition}
+                        ORDER BY id {order} LIMIT ?
+                    )
+                ) m
+                JOIN users u ON u.id = m.sender_id
+                ORDER BY m.id {order}
+                LIMIT ?
+            ''', (user_id, other_user_id, bound, limit,
+                  other_user_id, user_id, bound, limit, limit))
+            messages = cursor.fetchall()
+            if order == 'DESC':
+                messages.reverse()
+        
+        messages = with_seen_state(cursor, user_id, other_user_id, messages)
         conn.commit()
         conn.close()
         
         return jsonify({
-            "messages": [dict(msg) for msg in reversed(messages)]
+            "messages": messages,
+            "before_id": messages[0]['id'] if messages else before_id,
+            "after_id": messages[-1]['id'] if messages else after_id,
+            "has_more": len(messages) == limit
         }), 200
         
     except Exception as e:
@@ -114,40 +147,21 @@ def send_message():
             return jsonify({"error": "Message text required"}), 400
         
         # Check if users are friends
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id FROM friends 
-            WHERE (friend_1 = ? AND friend_2 = ?) OR (friend_1 = ? AND friend_2 = ?)
-        ''', (sender_id, receiver_id, receiver_id, sender_id))
-        
-        if not cursor.fetchone():
+        if not friend_graph.are_friends(sender_id, receiver_id):
             return jsonify({"error": "You can only message friends"}), 403
         
-        # Insert message
-        cursor.execute('''
-            INSERT INTO messages (sender_id, receiver_id, text)
-            VALUES (?, ?, ?)
-        ''', (sender_id, receiver_id, text))
+        conn = db.get_connection()
+        cursor = conn.cursor()
         
-        message_id = cursor.lastrowid
+        # Insert message; the payload comes back from the insert itself
+        message = insert_message(cursor, sender_id, receiver_id, text=text)
         
-        # Get the complete message data
-        cursor.execute('''
-            SELECT m.*, u.username, u.profile_photo_url
-            FROM messages m
-            JOIN users u ON u.id = m.sender_id
-            WHERE m.id = ?
-        ''', (message_id,))
-        
-        message = cursor.fetchone()
         conn.commit()
         conn.close()
         
         return jsonify({
             "message": "Message sent successfully",
-            "data": dict(message)
+            "data": message
         }), 200
         
     except Exception as e:
@@ -175,17 +189,12 @@ def upload_voice_note():
         )
         
         # Check if users are friends
+        if not friend_graph.are_friends(sender_id, receiver_id):
+            return jsonify({"error": "You can only message friends"}), 403
+        
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id FROM friends 
-            WHERE (friend_1 = ? AND friend_2 = ?) OR (friend_1 = ? AND friend_2 = ?)
-        ''', (sender_id, receiver_id, receiver_id, sender_id))
-        
-        if not cursor.fetchone():
-            return jsonify({"error": "You can only message friends"}), 403
-        
         # Insert message
         cursor.execute('''
             INSERT INTO messages (sender_id, receiver_id, file_url)
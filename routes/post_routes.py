@@ -1,7 +1,14 @@
 from flask import Blueprint, request, jsonify, session
 import cloudinary.uploader
 from database import db
-from utils import award_points
+from utils import award_points, decode_cursor, page_limit
+from cache import invalidate_profile
+import feed
+import ranking
+import timelines
+from friend_graph import friend_graph
+from stories import load_tray, story_created
+from story_views import story_views
 
 post_bp = Blueprint('posts', __name__)
 
@@ -25,21 +32,22 @@ def create_post():
         if not text and not image_url:
             return jsonify({"error": "Post must contain text or image"}), 400
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO posts (user_id, text, image_url)
-            VALUES (?, ?, ?)
-        ''', (user_id, text, image_url))
-        
-        post_id = cursor.lastrowid
-        
-        # Award points for posting
-        award_points(user_id, 5, 'New post')
+        with db.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO posts (user_id, text, image_url)
+                VALUES (?, ?, ?)
+            ''', (user_id, text, image_url))
+            
+            post_id = cursor.lastrowid
+            ranking.update_post(cursor, post_id)
+            timelines.push_post(cursor, user_id, post_id)
+            
+            # Award points for posting
+            award_points(user_id, 5, 'New post')
         
-        conn.commit()
-        conn.close()
+        invalidate_profile(user_id)
         
         return jsonify({
             "message": "Post created successfully",
@@ -82,54 +90,31 @@ def get_feed():
     try:
         user_id = session['user_id']
         feed_type = request.args.get('type', 'latest')  # latest, recommended, friends
+        limit = page_limit(request.args, 20, 50)
         page = int(request.args.get('page', 1))
-        limit = 20
-        offset = (page - 1) * limit
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        # Keyset position: (score, id) for recommended, (id,) otherwise
+        key_size = 2 if feed_type == 'recommended' else 1
+        token = request.args.get('cursor')
+        try:
+            position = decode_cursor(token, key_size) if token else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        if feed_type == 'friends':
-            # Only posts from friends
-            cursor.execute('''
-                SELECT p.*, u.username, u.full_name, u.profile_photo_url,
-                       (SELECT COUNT(*) FROM likes WHERE post_id = p.id) as likes_count,
-                       (SELECT COUNT(*) FROM comments WHERE post_id = p.id) as comments_count,
-                       (SELECT COUNT(*) FROM likes WHERE post_id = p.id AND user_id = ?) as user_liked
-                FROM posts p
-                JOIN users u ON u.id = p.user_id
-                WHERE p.user_id IN (
-                    SELECT CASE 
-                                               WHEN friend_1 = ? THEN friend_2
-                        ELSE friend_1
-                    END
-                    FROM friends 
-                    WHERE friend_1 = ? OR friend_2 = ?
-                )
-                ORDER BY p.created_at DESC
-                LIMIT ? OFFSET ?
-            ''', (user_id, user_id, user_id, user_id, limit, offset))
-        else:
-            # All posts (latest or recommended)
-            order_by = "p.created_at DESC" if feed_type == 'latest' else "p.likes_count DESC, p.created_at DESC"
-            
-            cursor.execute(f'''
-                SELECT p.*, u.username, u.full_name, u.profile_photo_url,
-                       (SELECT COUNT(*) FROM likes WHERE post_id = p.id) as likes_count,
-                       (SELECT COUNT(*) FROM comments WHERE post_id = p.id) as comments_count,
-                       (SELECT COUNT(*) FROM likes WHERE post_id = p.id AND user_id = ?) as user_liked
-                FROM posts p
-                JOIN users u ON u.id = p.user_id
-                WHERE u.status = 'approved'
-                ORDER BY {order_by}
-                LIMIT ? OFFSET ?
-            ''', (user_id, limit, offset))
-        
-        posts = cursor.fetchall()
+        # Legacy ?page=N without a cursor still works through OFFSET
+        offset = (page - 1) * limit if position is None else 0
+        
+        # A friend graph reload checks out its own connection, so resolve
+        # friends before holding one
+        friend_ids = friend_graph.friends_of(user_id) if feed_type == 'friends' else None
+        
+        conn = db.get_connection()
+        posts = feed.load_page(conn.cursor(), user_id, feed_type, position, limit, offset, friend_ids)
         conn.close()
         
         return jsonify({
-            "posts": [dict(post) for post in posts]
+            "posts": posts,
+            "next_cursor": feed.next_cursor(feed_type, posts, limit)
         }), 200
         
     except Exception as e:
@@ -146,58 +131,56 @@ def like_post():
         if not post_id:
             return jsonify({"error": "Post ID required"}), 400
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Check if already liked
-        cursor.execute(
-            'SELECT id FROM likes WHERE post_id = ? AND user_id = ?',
-            (post_id, user_id)
-        )
-        
-        if cursor.fetchone():
-            # Unlike
-            cursor.execute(
-                'DELETE FROM likes WHERE post_id = ? AND user_id = ?',
-                (post_id, user_id)
-            )
-            
-            # Update post likes count
-            cursor.execute(
-                'UPDATE posts SET likes_count = likes_count - 1 WHERE id = ?',
-                (post_id,)
-            )
+        with db.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
             
-            message = "Post unliked"
-            liked = False
-        else:
-            # Like
+            # Check if already liked
             cursor.execute(
-                'INSERT INTO likes (post_id, user_id) VALUES (?, ?)',
+                'SELECT id FROM likes WHERE post_id = ? AND user_id = ?',
                 (post_id, user_id)
             )
             
-            # Update post likes count
-            cursor.execute(
-                'UPDATE posts SET likes_count = likes_count + 1 WHERE id = ?',
-                (post_id,)
-            )
-            
-            # Award points to post author
-            cursor.execute('SELECT user_id FROM posts WHERE id = ?', (post_id,))
-            post_author = cursor.fetchone()
-            if post_author and post_author['user_id'] != user_id:
-                award_points(post_author['user_id'], 1, 'Post liked')
+            if cursor.fetchone():
+                # Unlike
+                cursor.execute(
+                    'DELETE FROM likes WHERE post_id = ? AND user_id = ?',
+                    (post_id, user_id)
+                )
+                
+                # Update post likes count
+                cursor.execute(
+                    'UPDATE posts SET likes_count = likes_count - 1 WHERE id = ?',
+                    (post_id,)
+                )
+                
+                message = "Post unliked"
+                liked = False
+            else:
+                # Like
+                cursor.execute(
+                    'INSERT INTO likes (post_id, user_id) VALUES (?, ?)',
+                    (post_id, user_id)
+                )
+                
+                # Update post likes count
+                cursor.execute(
+                    'UPDATE posts SET likes_count = likes_count + 1 WHERE id = ?',
+                    (post_id,)
+                )
+                
+                # Award points to post author
+                cursor.execute('SELECT user_id FROM posts WHERE id = ?', (post_id,))
+                post_author = cursor.fetchone()
+                if post_author and post_author['user_id'] != user_id:
+                    award_points(post_author['user_id'], 1, 'Post liked')
+                
+                message = "Post liked"
+                liked = True
             
-            message = "Post liked"
-            liked = True
-        
-        # Get updated likes count
-        cursor.execute('SELECT likes_count FROM posts WHERE id = ?', (post_id,))
-        likes_count = cursor.fetchone()['likes_count']
-        
-        conn.commit()
-        conn.close()
+            # Get updated likes count
+            cursor.execute('SELECT likes_count FROM posts WHERE id = ?', (post_id,))
+            likes_count = cursor.fetchone()['likes_count']
+            ranking.update_post(cursor, post_id)
         
         return jsonify({
             "message": message,
@@ -233,6 +216,7 @@ def add_comment():
             'UPDATE posts SET comments_count = comments_count + 1 WHERE id = ?',
             (post_id,)
         )
+        ranking.update_post(cursor, post_id)
         
         conn.commit()
         conn.close()
@@ -246,6 +230,11 @@ def add_comment():
 @require_auth
 def get_comments(post_id):
     try:
+        # Without limit/after_id the whole list is returned, as before paging
+        paged = 'limit' in request.args or 'after_id' in request.args
+        limit = page_limit(request.args, 100, 200) if paged else -1
+        after_id = request.args.get('after_id', 0, type=int)
+        
         conn = db.get_connection()
         cursor = conn.cursor()
         
@@ -253,15 +242,17 @@ def get_comments(post_id):
             SELECT c.*, u.username, u.full_name, u.profile_photo_url
             FROM comments c
             JOIN users u ON u.id = c.user_id
-            WHERE c.post_id = ?
-            ORDER BY c.created_at ASC
-        ''', (post_id,))
+            WHERE c.post_id = ? AND c.id > ?
+            ORDER BY c.id ASC
+            LIMIT ?
+        ''', (post_id, after_id, limit))
         
         comments = cursor.fetchall()
         conn.close()
         
         return jsonify({
-            "comments": [dict(comment) for comment in comments]
+            "comments": [dict(comment) for comment in comments],
+            "after_id": comments[-1]['id'] if len(comments) == limit else None
         }), 200
         
     except Exception as e:
@@ -284,20 +275,19 @@ def create_story():
             resource_type="auto"
         )
         
-        # Calculate expiry time (24 hours)
-        from datetime import datetime, timedelta
-        expires_at = datetime.now() + timedelta(hours=24)
-        
         conn = db.get_connection()
         cursor = conn.cursor()
         
+        # Expires in 24 hours, in UTC like the CURRENT_TIMESTAMP it is compared to
         cursor.execute('''
             INSERT INTO stories (user_id, file_url, expires_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, result['secure_url'], expires_at))
+            VALUES (?, ?, datetime('now', '+24 hours'))
+        ''', (user_id, result['secure_url']))
         
+        story_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        story_created(user_id, story_id)
         
         return jsonify({
             "message": "Story created successfully",
@@ -312,32 +302,19 @@ def create_story():
 def get_stories():
     try:
         user_id = session['user_id']
+        # Without limit/before_id the whole tray is returned, as before paging
+        paged = 'limit' in request.args or 'before_id' in request.args
+        limit = page_limit(request.args, 100, 200) if paged else -1
+        before_id = request.args.get('before_id', 2 ** 63 - 1, type=int)
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Get stories from friends that haven't expired
-        cursor.execute('''
-            SELECT s.*, u.username, u.full_name, u.profile_photo_url
-            FROM stories s
-            JOIN users u ON u.id = s.user_id
-            WHERE s.expires_at > CURRENT_TIMESTAMP
-            AND (s.user_id = ? OR s.user_id IN (
-                SELECT CASE 
-                    WHEN friend_1 = ? THEN friend_2
-                    ELSE friend_1
-                END
-                FROM friends 
-                WHERE friend_1 = ? OR friend_2 = ?
-            ))
-            ORDER BY s.created_at DESC
-        ''', (user_id, user_id, user_id, user_id))
-        
-        stories = cursor.fetchall()
-        conn.close()
+        # Get stories from friends that haven't expired. Resolved before any
+        # connection is held: a friend graph reload checks out its own
+        friend_ids = friend_graph.friends_of(user_id)
+        stories = load_tray(db, user_id, friend_ids, before_id, limit)
         
         return jsonify({
-            "stories": [dict(story) for story in stories]
+            "stories": stories,
+            "before_id": stories[-1]['id'] if len(stories) == limit else None
         }), 200
         
     except Exception as e:
@@ -347,20 +324,27 @@ def get_stories():
 @require_auth
 def view_story(story_id):
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Increment view count
-        cursor.execute(
-            'UPDATE stories SET view_count = view_count + 1 WHERE id = ?',
-            (story_id,)
-        )
-        
-        conn.commit()
-        conn.close()
+        # Buffered and deduplicated per viewer; written in the next flush
+        if not story_views.record(story_id, session['user_id']):
+            return jsonify({"error": "Story not found"}), 404
         
         return jsonify({"message": "Story viewed"}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-                        
\ No newline at end of file
+
+@post_bp.route('/stories/<int:story_id>/viewers')
+@require_auth
+def get_story_viewers(story_id):
+    try:
+        limit = page_limit(request.args, 100, 500)
+        
+        if story_views.owner_of(story_id) != session['user_id']:
+            return jsonify({"error": "Story not found"}), 404
+        
+        return jsonify({
+            "viewers": story_views.viewers(story_id, limit=limit)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
\ No newline at end of file
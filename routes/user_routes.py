@@ -1,7 +1,15 @@
 from flask import Blueprint, request, jsonify, session
+import json
 import cloudinary.uploader
 from database import db
-from utils import award_points
+from utils import award_points, page_limit
+from cache import profile_cache, cache_profile, invalidate_profile
+from friend_graph import friend_graph
+from leaderboard import leaderboard
+from candidates import candidate_pools
+from presence import presence
+import search
+import timelines
 
 user_bp = Blueprint('user', __name__)
 
@@ -17,6 +25,10 @@ def require_auth(f):
 @require_auth
 def get_profile(username):
     try:
+        profile = profile_cache.get(username)
+        if profile is not None:
+            return jsonify({"user": profile}), 200
+        
         conn = db.get_connection()
         cursor = conn.cursor()
         
@@ -33,23 +45,24 @@ def get_profile(username):
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        return jsonify({
-            "user": {
-                "id": user['id'],
-                "username": user['username'],
-                "full_name": user['full_name'],
-                "age": user['age'],
-                "city": user['city'],
-                "college_name": user['college_name'],
-                "bio": user['bio'],
-                "interests": user['interests'],
-                "teengram_number": user['teengram_number'],
-                "profile_photo_url": user['profile_photo_url'],
-                "points": user['points'],
-                "posts_count": user['posts_count'],
-                "friends_count": user['friends_count']
-            }
-        }), 200
+        profile = {
+            "id": user['id'],
+            "username": user['username'],
+            "full_name": user['full_name'],
+            "age": user['age'],
+            "city": user['city'],
+            "college_name": user['college_name'],
+            "bio": user['bio'],
+            "interests": user['interests'],
+            "teengram_number": user['teengram_number'],
+            "profile_photo_url": user['profile_photo_url'],
+            "points": user['points'],
+            "posts_count": user['posts_count'],
+            "friends_count": user['friends_count']
+        }
+        cache_profile(profile)
+        
+        return jsonify({"user": profile}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -83,6 +96,9 @@ def update_profile():
         )
         conn.commit()
         conn.close()
+        invalidate_profile(user_id)
+        leaderboard.refresh_user(user_id)
+        candidate_pools.refresh_user(user_id)
         
         return jsonify({"message": "Profile updated successfully"}), 200
         
@@ -99,22 +115,11 @@ def search_users():
             return jsonify({"users": []}), 200
         
         conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, full_name, profile_photo_url, college_name
-            FROM users 
-            WHERE (username LIKE ? OR full_name LIKE ?) 
-            AND status = 'approved' 
-            AND id != ?
-            LIMIT 20
-        ''', (f'%{query}%', f'%{query}%', session['user_id']))
-        
-        users = cursor.fetchall()
+        users = search.search_users(conn.cursor(), query, session['user_id'], limit=20)
         conn.close()
         
         return jsonify({
-            "users": [dict(user) for user in users]
+            "users": users
         }), 200
         
     except Exception as e:
@@ -125,35 +130,36 @@ def search_users():
 def campus_connect():
     try:
         user_id = session['user_id']
+        mode = request.args.get('mode', 'random')  # random, same_college, same_city
+        
+        # Exclude friends and users skipped in the last 30 days
+        with db.connection() as conn:
+            skipped = conn.execute('''
+                SELECT skipped_user_id FROM skips 
+                WHERE user_id = ? AND created_at > datetime('now', '-30 days')
+            ''', (user_id,)).fetchall()
+        
+        # No connection is held here: the friend graph and candidate pools
+        # check out their own when they reload
+        exclude = {row['skipped_user_id'] for row in skipped}
+        exclude |= friend_graph.friends_of(user_id)
+        candidate_ids = candidate_pools.sample(user_id, 10, exclude, mode=mode)
         
         conn = db.get_connection()
         cursor = conn.cursor()
-        
-        # Get users that haven't been skipped in last 30 days and not already friends
         cursor.execute('''
             SELECT u.id, u.username, u.full_name, u.profile_photo_url, 
                    u.college_name, u.age, u.city
             FROM users u
-            WHERE u.id != ? 
+            WHERE u.id IN (SELECT value FROM json_each(?))
             AND u.status = 'approved'
-            AND u.id NOT IN (
-                SELECT friend_1 FROM friends WHERE friend_2 = ?
-                UNION
-                SELECT friend_2 FROM friends WHERE friend_1 = ?
-            )
-            AND u.id NOT IN (
-                SELECT skipped_user_id FROM skips 
-                WHERE user_id = ? AND created_at > datetime('now', '-30 days')
-            )
-            ORDER BY RANDOM()
-            LIMIT 10
-        ''', (user_id, user_id, user_id, user_id))
+        ''', (json.dumps(candidate_ids),))
         
-        users = cursor.fetchall()
+        users = {user['id']: dict(user) for user in cursor.fetchall()}
         conn.close()
         
         return jsonify({
-            "users": [dict(user) for user in users]
+            "users": [users[candidate_id] for candidate_id in candidate_ids if candidate_id in users]
         }), 200
         
     except Exception as e:
@@ -170,55 +176,55 @@ def send_wave():
         if not receiver_id:
             return jsonify({"error": "Receiver ID required"}), 400
         
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        # Check if already waved
-        cursor.execute(
-            'SELECT id FROM waves WHERE sender_id = ? AND receiver_id = ?',
-            (sender_id, receiver_id)
-        )
-        
-        if cursor.fetchone():
-            return jsonify({"error": "Already waved to this user"}), 400
-        
-        # Insert wave
-        cursor.execute(
-            'INSERT INTO waves (sender_id, receiver_id) VALUES (?, ?)',
-            (sender_id, receiver_id)
-        )
-        
-        # Check if receiver also waved back
-        cursor.execute(
-            'SELECT id FROM waves WHERE sender_id = ? AND receiver_id = ?',
-            (receiver_id, sender_id)
-        )
-        
-        mutual_wave = cursor.fetchone()
-        
-        if mutual_wave:
-            # Create friendship
+        with db.transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+            
+            # Check if already waved
             cursor.execute(
-                'INSERT INTO friends (friend_1, friend_2) VALUES (?, ?)',
-                (min(sender_id, receiver_id), max(sender_id, receiver_id))
+                'SELECT id FROM waves WHERE sender_id = ? AND receiver_id = ?',
+                (sender_id, receiver_id)
             )
             
-            # Award points to both users
-            award_points(sender_id, 2, 'New friend')
-            award_points(receiver_id, 2, 'New friend')
+            if cursor.fetchone():
+                return jsonify({"error": "Already waved to this user"}), 400
             
-            conn.commit()
-            conn.close()
+            # Insert wave
+            cursor.execute(
+                'INSERT INTO waves (sender_id, receiver_id) VALUES (?, ?)',
+                (sender_id, receiver_id)
+            )
+            
+            # Check if receiver also waved back
+            cursor.execute(
+                'SELECT id FROM waves WHERE sender_id = ? AND receiver_id = ?',
+                (receiver_id, sender_id)
+            )
+            
+            mutual_wave = cursor.fetchone()
+            
+            if mutual_wave:
+                # Create friendship
+                cursor.execute(
+                    'INSERT INTO friends (friend_1, friend_2) VALUES (?, ?)',
+                    (min(sender_id, receiver_id), max(sender_id, receiver_id))
+                )
+                timelines.backfill_friendship(cursor, sender_id, receiver_id)
+                
+                # Award points to both users
+                award_points(sender_id, 2, 'New friend')
+                award_points(receiver_id, 2, 'New friend')
+        
+        if mutual_wave:
+            friend_graph.add_friendship(sender_id, receiver_id)
+            invalidate_profile(sender_id)
+            invalidate_profile(receiver_id)
             
             return jsonify({
                 "message": "Connected! You're now friends!",
                 "connected": True
             }), 200
         
-        conn.commit()
-        conn.close()
-        
-               return jsonify({
+        return jsonify({
             "message": "Wave sent successfully",
             "connected": False
         }), 200
@@ -277,11 +283,22 @@ def get_friends():
             ORDER BY f.connected_time DESC
         ''', (user_id, user_id, user_id))
         
-        friends = cursor.fetchall()
+        friends = [dict(friend) for friend in cursor.fetchall()]
         conn.close()
         
         return jsonify({
-            "friends": [dict(friend) for friend in friends]
+            "friends": presence.annotate(friends)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@user_bp.route('/friends/online')
+@require_auth
+def get_online_friends():
+    try:
+        return jsonify({
+            "online": sorted(presence.online_friends(session['user_id']))
         }), 200
         
     except Exception as e:
@@ -291,23 +308,28 @@ def get_friends():
 @require_auth
 def get_leaderboard():
     try:
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        college = request.args.get('college')
+        limit = page_limit(request.args, 50, 100)
         
-        cursor.execute('''
-            SELECT username, full_name, college_name, points,
-                   ROW_NUMBER() OVER (ORDER BY points DESC) as rank
-            FROM users 
-            WHERE status = 'approved'
-            ORDER BY points DESC
-            LIMIT 50
-        ''', )
-        
-        leaderboard = cursor.fetchall()
-        conn.close()
+        return jsonify({
+            "leaderboard": leaderboard.top(limit, college=college)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@user_bp.route('/leaderboard/me')
+@require_auth
+def get_my_rank():
+    try:
+        college = request.args.get('college')
+        window = max(0, min(request.args.get('window', 5, type=int), 25))
+        
+        rank, around = leaderboard.around(session['user_id'], window, college=college)
         
         return jsonify({
-            "leaderboard": [dict(user) for user in leaderboard]
+            "rank": rank,
+            "around": around
         }), 200
         
     except Exception as e:
@@ -0,0 +1,96 @@
+"""Full-text user search.
+
+users_fts is an FTS5 index over username, full_name, college_name and
+city, backed by the users table (external content) and kept in sync by
+triggers, so signup and profile edits need no extra code. Queries match
+every term as a prefix and rank username-prefix hits first, then by
+bm25 with username weighted highest. If this SQLite build lacks FTS5
+the migration leaves the index out and search falls back to LIKE.
+"""
+import re
+import sqlite3
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+# bm25 weights for username, full_name, college_name, city
+_WEIGHTS = '10.0, 5.0, 1.0, 1.0'
+
+_available = None
+
+def create_index(conn):
+    """Migration step: build users_fts and its sync triggers, if FTS5 exists"""
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                username, full_name, college_name, city,
+                content='users', content_rowid='id',
+                prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        return  # no FTS5 in this build; search_users falls back to LIKE
+    
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, username, full_name, college_name, city)
+            VALUES (NEW.id, NEW.username, NEW.full_name, NEW.college_name, NEW.city);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, full_name, college_name, city)
+            VALUES ('delete', OLD.id, OLD.username, OLD.full_name, OLD.college_name, OLD.city);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+        AFTER UPDATE OF username, full_name, college_name, city ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, full_name, college_name, city)
+            VALUES ('delete', OLD.id, OLD.username, OLD.full_name, OLD.college_name, OLD.city);
+            INSERT INTO users_fts (rowid, username, full_name, college_name, city)
+            VALUES (NEW.id, NEW.username, NEW.full_name, NEW.college_name, NEW.city);
+        END
+    ''')
+    conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+def fts_available(cursor):
+    global _available
+    if _available is None:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+        _available = cursor.fetchone() is not None
+    return _available
+
+def match_expression(query):
+    """'Jo Sm' -> '"jo"* "sm"*' (every term must match as a prefix)"""
+    terms = _TERM.findall(query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_users(cursor, query, exclude_user_id, limit=20):
+    query = query.strip().lower()
+    expression = match_expression(query)
+    
+    if expression and fts_available(cursor):
+        cursor.execute(f'''
+            SELECT u.id, u.username, u.full_name, u.profile_photo_url, u.college_name
+            FROM users_fts f
+            JOIN users u ON u.id = f.rowid
+            WHERE users_fts MATCH ?
+            AND u.status = 'approved'
+            AND u.id != ?
+            ORDER BY substr(u.username, 1, ?) = ? DESC, bm25(users_fts, {_WEIGHTS})
+            LIMIT ?
+        ''', (expression, exclude_user_id, len(query), query, limit))
+    else:
+        cursor.execute('''
+            SELECT id, username, full_name, profile_photo_url, college_name
+            FROM users 
+            WHERE (username LIKE ? OR full_name LIKE ?) 
+            AND status = 'approved' 
+            AND id != ?
+            LIMIT ?
+        ''', (f'%{query}%', f'%{query}%', exclude_user_id, limit))
+    
+    return [dict(user) for user in cursor.fetchall()]
@@ -0,0 +1,212 @@
+"""Socket connection and typing state shared between workers.
+
+A socket id belongs to one worker, but "is this user online" and "who
+is typing" have to be answered by any worker. Both backends index
+sockets in both directions (sid -> user, user -> {sids}), so online
+checks are a lookup per user, and keep per-socket heartbeats and
+per-user last-seen times for presence.py. The store behind them is
+chosen by SOCKET_STATE_URL (defaulting to SOCKETIO_MESSAGE_QUEUE):
+
+    memory (or unset)   in-process dicts; correct for a single worker
+    redis://host/db     shared Redis keys with a TTL; needed with -w > 1
+"""
+import json
+import os
+import threading
+import time
+
+class MemoryStateStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sids = {}  # sid -> user_id
+        self._user_sids = {}  # user_id -> {sid}
+        self._typing = {}  # sid -> {'user_id', 'other_user_id'}
+        self._heartbeats = {}  # sid -> unix time of last heartbeat
+        self._last_seen = {}  # user_id -> unix time
+    
+    def connect(self, sid, user_id):
+        now = time.time()
+        with self._lock:
+            self._sids[sid] = user_id
+            self._user_sids.setdefault(user_id, set()).add(sid)
+            self._heartbeats[sid] = now
+            self._last_seen[user_id] = now
+    
+    def disconnect(self, sid):
+        """Forget a socket; returns its user id, or None if it was unknown"""
+        with self._lock:
+            user_id = self._sids.pop(sid, None)
+            self._typing.pop(sid, None)
+            self._heartbeats.pop(sid, None)
+            if user_id is not None:
+                self._last_seen[user_id] = time.time()
+                sids = self._user_sids.get(user_id)
+                if sids is not None:
+                    sids.discard(sid)
+                    if not sids:
+                        del self._user_sids[user_id]
+            return user_id
+    
+    def user_for(self, sid):
+        return self._sids.get(sid)
+    
+    def is_online(self, user_id):
+        return user_id in self._user_sids
+    
+    def online_among(self, user_ids):
+        return {user_id for user_id in user_ids if user_id in self._user_sids}
+    
+    def heartbeat(self, sid):
+        user_id = self._sids.get(sid)
+        if user_id is not None:
+            now = time.time()
+            self._heartbeats[sid] = now
+            self._last_seen[user_id] = now
+    
+    def touch(self, sockets):
+        """Heartbeat many (sid, user_id) pairs at once"""
+        now = time.time()
+        with self._lock:
+            for sid, user_id in sockets:
+                if sid in self._sids:
+                    self._heartbeats[sid] = now
+                    self._last_seen[user_id] = now
+    
+    def stale_sids(self, max_age):
+        """Sockets with no heartbeat for max_age seconds"""
+        cutoff = time.time() - max_age
+        return [sid for sid, at in list(self._heartbeats.items()) if at < cutoff]
+    
+    def last_seen(self, user_ids):
+        return {user_id: self._last_seen[user_id] for user_id in user_ids if user_id in self._last_seen}
+    
+    def set_typing(self, sid, user_id, other_user_id):
+        self._typing[sid] = {'user_id': user_id, 'other_user_id': other_user_id}
+    
+    def clear_typing(self, sid):
+        self._typing.pop(sid, None)
+    
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'sockets': len(self._sids),
+            'online_users': len(self._user_sids),
+            'typing': len(self._typing),
+            'last_seen_users': len(self._last_seen)
+        }
+
+class RedisStateStore:
+    """Same interface as MemoryStateStore, kept in Redis under `prefix`.
+    
+    Per-socket keys (sid -> user, typing) and the per-user socket sets
+    expire after `ttl` seconds unless a connect or heartbeat renews them,
+    so sockets of a worker that died without disconnecting drop out on
+    their own even if no other worker's sweep reaps them.
+    """
+    
+    def __init__(self, url, prefix='teengram:sockets', ttl=90):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = max(int(ttl), 1)
+    
+    def _key(self, *parts):
+        return ':'.join((self.prefix, *map(str, parts)))
+    
+    def connect(self, sid, user_id):
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.set(self._key('sid', sid), user_id, ex=self.ttl)
+        pipe.sadd(self._key('user', user_id), sid)
+        pipe.expire(self._key('user', user_id), self.ttl)
+        pipe.zadd(self._key('heartbeats'), {sid: now})
+        pipe.expire(self._key('heartbeats'), self.ttl)
+        pipe.hset(self._key('last_seen'), user_id, now)
+        pipe.execute()
+    
+    def disconnect(self, sid):
+        user_id = self.user_for(sid)
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key('sid', sid), self._key('typing', sid))
+        pipe.zrem(self._key('heartbeats'), sid)
+        if user_id is not None:
+            pipe.srem(self._key('user', user_id), sid)
+            pipe.hset(self._key('last_seen'), user_id, time.time())
+        pipe.execute()
+        return user_id
+    
+    def user_for(self, sid):
+        user_id = self.redis.get(self._key('sid', sid))
+        return int(user_id) if user_id is not None else None
+    
+    def is_online(self, user_id):
+        return bool(self.redis.exists(self._key('user', user_id)))
+    
+    def online_among(self, user_ids):
+        user_ids = list(user_ids)
+        pipe = self.redis.pipeline()
+        for user_id in user_ids:
+            pipe.exists(self._key('user', user_id))
+        return {user_id for user_id, online in zip(user_ids, pipe.execute()) if online}
+    
+    def heartbeat(self, sid):
+        user_id = self.user_for(sid)
+        if user_id is not None:
+            now = time.time()
+            pipe = self.redis.pipeline()
+            pipe.expire(self._key('sid', sid), self.ttl)
+            pipe.expire(self._key('typing', sid), self.ttl)
+            pipe.expire(self._key('user', user_id), self.ttl)
+            pipe.zadd(self._key('heartbeats'), {sid: now})
+            pipe.expire(self._key('heartbeats'), self.ttl)
+            pipe.hset(self._key('last_seen'), user_id, now)
+            pipe.execute()
+    
+    def touch(self, sockets):
+        """Heartbeat many (sid, user_id) pairs in one round trip"""
+        now = time.time()
+        pipe = self.redis.pipeline()
+        for sid, user_id in sockets:
+            pipe.expire(self._key('sid', sid), self.ttl)
+            pipe.expire(self._key('user', user_id), self.ttl)
+            pipe.zadd(self._key('heartbeats'), {sid: now})
+            pipe.hset(self._key('last_seen'), user_id, now)
+        pipe.expire(self._key('heartbeats'), self.ttl)
+        pipe.execute()
+    
+    def stale_sids(self, max_age):
+        sids = self.redis.zrangebyscore(self._key('heartbeats'), '-inf', time.time() - max_age)
+        return [sid.decode() for sid in sids]
+    
+    def last_seen(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        values = self.redis.hmget(self._key('last_seen'), user_ids)
+        return {user_id: float(at) for user_id, at in zip(user_ids, values) if at is not None}
+    
+    def set_typing(self, sid, user_id, other_user_id):
+        self.redis.set(self._key('typing', sid), json.dumps({
+            'user_id': user_id,
+            'other_user_id': other_user_id
+        }), ex=self.ttl)
+    
+    def clear_typing(self, sid):
+        self.redis.delete(self._key('typing', sid))
+    
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'sockets': self.redis.zcard(self._key('heartbeats')),
+            'ttl': self.ttl
+        }
+
+def create_store(url=None):
+    url = url or os.getenv('SOCKET_STATE_URL') or os.getenv('SOCKETIO_MESSAGE_QUEUE') or 'memory'
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisStateStore(url, ttl=float(os.getenv('PRESENCE_TIMEOUT', 90)))
+    if url == 'memory':
+        return MemoryStateStore()
+    raise ValueError(f"Unsupported socket state backend: {url}")
+
+socket_state = create_store()
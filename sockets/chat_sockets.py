@@ -1,15 +1,19 @@
 from flask_socketio import emit, join_room, leave_room, disconnect
 from flask import session, request
 from database import db
+from conversations import mark_read
+from friend_graph import friend_graph
+from utils import check_ban_status
+from extensions import socketio
+from presence import presence
+from messaging import insert_message
+from typing_indicators import typing_indicators
 import json
 
-# Store active users
-active_users = {}
-typing_users = {}
-
 def authenticated_only(f):
     def wrapped(*args, **kwargs):
-        if 'user_id' not in session:
+        # Ban status is cached, so this is a memory lookup on almost every event
+        if 'user_id' not in session or check_ban_status(session['user_id'])['is_banned']:
             disconnect()
         else:
             return f(*args, **kwargs)
@@ -19,7 +23,7 @@ def authenticated_only(f):
 @authenticated_only
 def on_connect():
     user_id = session['user_id']
-    active_users[request.sid] = user_id
+    presence.connected(request.sid, user_id)
     
     # Join user's personal room
     join_room(f"user_{user_id}")
@@ -29,16 +33,17 @@ def on_connect():
 
 @socketio.on('disconnect')
 def on_disconnect():
-    if request.sid in active_users:
-        user_id = active_users[request.sid]
-        del active_users[request.sid]
-        
-        # Remove from typing users
-        if request.sid in typing_users:
-            del typing_users[request.sid]
-        
+    typing_indicators.disconnected(request.sid)
+    user_id = presence.disconnected(request.sid)
+    if user_id is not None:
         print(f"User {user_id} disconnected")
 
+@socketio.on('heartbeat')
+@authenticated_only
+def on_heartbeat():
+    # Optional: presence renews every connected socket on its own
+    presence.heartbeat(request.sid)
+
 @socketio.on('join_chat')
 @authenticated_only
 def on_join_chat(data):
@@ -71,35 +76,15 @@ def on_send_message(data):
         text = data['text']
         
         # Verify friendship
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id FROM friends 
-            WHERE (friend_1 = ? AND friend_2 = ?) OR (friend_1 = ? AND friend_2 = ?)
-        ''', (sender_id, receiver_id, receiver_id, sender_id))
-        
-        if not cursor.fetchone():
+        if not friend_graph.are_friends(sender_id, receiver_id):
             emit('error', {'message': 'You can only message friends'})
             return
         
-        # Insert message
-        cursor.execute('''
-            INSERT INTO messages (sender_id, receiver_id, text)
-            VALUES (?, ?, ?)
-        ''', (sender_id, receiver_id, text))
-        
-        message_id = cursor.lastrowid
-        
-        # Get complete message data
-        cursor.execute('''
-            SELECT m.*, u.username, u.profile_photo_url
-            FROM messages m
-            JOIN users u ON u.id = m.sender_id
-            WHERE m.id = ?
-        ''', (message_id,))
+        conn = db.get_connection()
+        cursor = conn.cursor()
         
-        message = dict(cursor.fetchone())
+        # Insert message; the payload comes back from the insert itself
+        message = insert_message(cursor, sender_id, receiver_id, text=text)
         
         conn.commit()
         conn.close()
@@ -121,33 +106,13 @@ def on_send_message(data):
 @socketio.on('typing_start')
 @authenticated_only
 def on_typing_start(data):
-    user_id = session['user_id']
-    other_user_id = data['other_user_id']
-    
-    typing_users[request.sid] = {
-        'user_id': user_id,
-        'other_user_id': other_user_id
-    }
-    
-    room = f"chat_{min(user_id, other_user_id)}_{max(user_id, other_user_id)}"
-    socketio.emit('user_typing', {
-        'user_id': user_id,
-        'username': session.get('username')
-    }, room=room, include_self=False)
+    # Coalesced and rate limited per (user, chat) before reaching the room
+    typing_indicators.start(request.sid, session['user_id'], data['other_user_id'], session.get('username'))
 
 @socketio.on('typing_stop')
 @authenticated_only
 def on_typing_stop(data):
-    user_id = session['user_id']
-    other_user_id = data['other_user_id']
-    
-    if request.sid in typing_users:
-        del typing_users[request.sid]
-    
-    room = f"chat_{min(user_id, other_user_id)}_{max(user_id, other_user_id)}"
-    socketio.emit('user_stopped_typing', {
-        'user_id': user_id
-    }, room=room, include_self=False)
+    typing_indicators.stop(request.sid, session['user_id'], data['other_user_id'])
 
 @socketio.on('mark_seen')
 @authenticated_only
@@ -155,22 +120,29 @@ def on_mark_seen(data):
     try:
         user_id = session['user_id']
         other_user_id = data['other_user_id']
+        message_id = data.get('message_id')  # seen up to here; default the latest
+        
+        # Compared inside SQL, so a string or float would store a bogus watermark
+        if message_id is not None:
+            if isinstance(message_id, str) and message_id.isdigit():
+                message_id = int(message_id)
+            if isinstance(message_id, bool) or not isinstance(message_id, int):
+                emit('error', {'message': 'Invalid message_id'})
+                return
         
         conn = db.get_connection()
         cursor = conn.cursor()
         
-        # Mark messages as seen
-        cursor.execute('''
-            UPDATE messages SET is_seen = 1 
-            WHERE sender_id = ? AND receiver_id = ? AND is_seen = 0
-        ''', (other_user_id, user_id))
+        # Mark messages as seen: one UPSERT of the read watermark
+        last_read_message_id = mark_read(cursor, user_id, other_user_id, message_id)
         
         conn.commit()
         conn.close()
         
         # Notify sender that messages were seen
         socketio.emit('messages_seen', {
-            'seen_by': user_id
+            'seen_by': user_id,
+            'last_read_message_id': last_read_message_id
         }, room=f"user_{other_user_id}")
         
     except Exception as e:
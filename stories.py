@@ -0,0 +1,205 @@
+"""Story expiry and the active-story index.
+
+Stories live for 24 hours. A background sweeper removes expired rows in
+small batches (one short transaction each) so the stories table only
+ever holds live stories plus at most one sweep interval of stale ones.
+With STORY_EXPIRY_MODE=archive, expired rows are copied to
+stories_archive before they are deleted.
+
+With STORY_INDEX=1 each worker also keeps the ids of live stories per
+user in memory. The stories tray then reads the viewer's and their
+friends' stories by id instead of scanning for unexpired rows. New and
+swept stories are published to the other workers' indexes.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from background import PeriodicTask
+from invalidation import invalidation_bus
+
+logger = logging.getLogger('teengram.stories')
+
+EXPIRY_MODE = os.getenv('STORY_EXPIRY_MODE', 'delete')  # delete, archive
+SWEEP_BATCH = int(os.getenv('STORY_SWEEP_BATCH', 500))
+INDEX_ENABLED = os.getenv('STORY_INDEX', '0') == '1'
+
+STORY_COLUMNS = 'id, user_id, file_url, view_count, created_at, expires_at'
+
+class ActiveStoryIndex:
+    """Live story ids per user; the database stays the authority on expiry"""
+    
+    def __init__(self, database, reload_interval=600.0):
+        self.db = database
+        self.reload_interval = reload_interval
+        self._by_user = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+    
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.reload_interval:
+            return
+        
+        with self._lock:
+            if self._loaded_at is not loaded_at:
+                return
+            
+            by_user = {}
+            with self.db.connection() as conn:
+                for story_id, user_id in conn.execute(
+                    'SELECT id, user_id FROM stories WHERE expires_at > CURRENT_TIMESTAMP'
+                ):
+                    by_user.setdefault(user_id, set()).add(story_id)
+            
+            self._by_user = by_user
+            self._loaded_at = time.monotonic()
+    
+    def add(self, user_id, story_id):
+        if self._loaded_at is None:
+            return  # picked up by the first load
+        with self._lock:
+            self._by_user.setdefault(int(user_id), set()).add(story_id)
+    
+    def remove(self, expired):
+        """Drop (story_id, user_id) pairs removed by a sweep"""
+        with self._lock:
+            for story_id, user_id in expired:
+                ids = self._by_user.get(user_id)
+                if ids is not None:
+                    ids.discard(story_id)
+                    if not ids:
+                        del self._by_user[user_id]
+    
+    def story_ids(self, user_ids):
+        self._ensure_loaded()
+        by_user = self._by_user
+        return [story_id for user_id in user_ids for story_id in by_user.get(user_id, ())]
+    
+    def stats(self):
+        by_user = self._by_user
+        return {
+            'loaded': self._loaded_at is not None,
+            'users': len(by_user),
+            'stories': sum(len(ids) for ids in by_user.values())
+        }
+
+active_stories = None
+
+if INDEX_ENABLED:
+    # Only the index needs the app's database; sweep() takes one as an argument
+    from database import db
+    active_stories = ActiveStoryIndex(db, reload_interval=float(os.getenv('STORY_INDEX_RELOAD', 600)))
+
+if active_stories is not None:
+    invalidation_bus.subscribe('story_created', active_stories.add)
+    invalidation_bus.subscribe('stories_expired', active_stories.remove)
+
+_sweeper = None
+_last_sweep = None
+_total_swept = 0
+
+def load_tray(database, user_id, friend_ids, before_id, limit):
+    """Live stories of the viewer and their friends, newest first.
+    
+    The index is consulted before a connection is checked out, since a
+    reload of the index needs a connection of its own.
+    """
+    user_ids = [int(user_id), *sorted(friend_ids)]
+    
+    if active_stories is not None:
+        column, ids = 's.id', active_stories.story_ids(user_ids)
+    else:
+        column, ids = 's.user_id', user_ids
+    
+    with database.connection() as conn:
+        cursor = conn.execute(f'''
+            SELECT s.*, u.username, u.full_name, u.profile_photo_url
+            FROM stories s
+            JOIN users u ON u.id = s.user_id
+            WHERE {column} IN (SELECT value FROM json_each(?))
+            AND s.expires_at > CURRENT_TIMESTAMP
+            AND s.id < ?
+            ORDER BY s.id DESC
+            LIMIT ?
+        ''', (json.dumps(ids), before_id, limit))
+        return [dict(story) for story in cursor.fetchall()]
+
+def story_created(user_id, story_id):
+    if active_stories is not None:
+        active_stories.add(user_id, story_id)
+        invalidation_bus.publish('story_created', int(user_id), story_id)
+
+def sweep(database, batch_size=SWEEP_BATCH, mode=EXPIRY_MODE):
+    """Delete (or archive) expired stories in batches.
+    
+    Returns the number of rows handled; per-sweep figures are kept for
+    the admin stats endpoint.
+    """
+    global _last_sweep, _total_swept
+    started = time.perf_counter()
+    swept = 0
+    batches = 0
+    
+    while True:
+        with database.transaction(immediate=True) as conn:
+            expired = conn.execute('''
+                SELECT id, user_id FROM stories
+                WHERE expires_at <= CURRENT_TIMESTAMP
+                ORDER BY expires_at
+                LIMIT ?
+            ''', (batch_size,)).fetchall()
+            if not expired:
+                break
+            
+            ids = json.dumps([row['id'] for row in expired])
+            if mode == 'archive':
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO stories_archive ({STORY_COLUMNS})
+                    SELECT {STORY_COLUMNS} FROM stories
+                    WHERE id IN (SELECT value FROM json_each(?))
+                ''', (ids,))
+            conn.execute('DELETE FROM story_views WHERE story_id IN (SELECT value FROM json_each(?))', (ids,))
+            conn.execute('DELETE FROM stories WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+        
+        if active_stories is not None:
+            pairs = [(row['id'], row['user_id']) for row in expired]
+            active_stories.remove(pairs)
+            invalidation_bus.publish('stories_expired', pairs)
+        swept += len(expired)
+        batches += 1
+        if len(expired) < batch_size:
+            break
+        time.sleep(0)  # let request greenlets in between batches
+    
+    duration_ms = (time.perf_counter() - started) * 1000
+    _total_swept += swept
+    _last_sweep = {
+        'rows': swept,
+        'batches': batches,
+        'mode': mode,
+        'duration_ms': round(duration_ms, 2),
+        'at': time.time()
+    }
+    if swept:
+        logger.info("Story sweep %sd %d rows in %d batches (%.1fms)", mode, swept, batches, duration_ms)
+    return swept
+
+def start_sweeper(database):
+    """Run sweep every STORY_SWEEP_INTERVAL seconds (0 disables)"""
+    global _sweeper
+    interval = float(os.getenv('STORY_SWEEP_INTERVAL', 300))
+    if interval <= 0 or _sweeper is not None:
+        return
+    _sweeper = PeriodicTask('story-sweep', interval, lambda: sweep(database))
+    _sweeper.start()
+
+def stats():
+    return {
+        'expiry_mode': EXPIRY_MODE,
+        'last_sweep': _last_sweep,
+        'total_swept': _total_swept,
+        'index': active_stories.stats() if active_stories is not None else None
+    }
@@ -0,0 +1,243 @@
+"""Unique, write-coalesced story view counting.
+
+view_story only records the view in memory. Every worker keeps a
+unique-viewer counter per recently viewed story: an exact id set while
+the audience is small, promoted to a HyperLogLog sketch (about 4KB, ~1.6%
+error) once it passes STORY_VIEW_SKETCH_THRESHOLD viewers. Repeat views
+by the same viewer are dropped before they reach the database.
+
+New (story, viewer) pairs are flushed every STORY_VIEW_FLUSH_INTERVAL
+seconds in one transaction: the pairs go into story_views (which backs
+the owner's "who viewed" list) and each touched story gets one
+view_count update. Like the points ledger, a crash loses at most one
+flush interval of views.
+"""
+import atexit
+import hashlib
+import logging
+import math
+import os
+import threading
+from datetime import datetime
+
+from background import PeriodicTask
+from cache import LRUCache
+from database import db
+
+logger = logging.getLogger('teengram.story_views')
+
+class HyperLogLog:
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        width = 64 - self.precision
+        index = hashed >> width
+        rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+class UniqueViewers:
+    """Exact viewer set that turns into a HyperLogLog sketch when it grows"""
+
+    def __init__(self, sketch_threshold=2048):
+        self.sketch_threshold = sketch_threshold
+        self._exact = set()
+        self._sketch = None
+
+    @property
+    def exact(self):
+        return self._sketch is None
+
+    def add(self, viewer_id):
+        """True for a new viewer, False for a repeat, None once only the sketch knows"""
+        if self._sketch is not None:
+            self._sketch.add(viewer_id)
+            return None
+        if viewer_id in self._exact:
+            return False
+
+        self._exact.add(viewer_id)
+        if len(self._exact) > self.sketch_threshold:
+            self._sketch = HyperLogLog()
+            for known in self._exact:
+                self._sketch.add(known)
+            self._exact = None
+        return True
+
+    def count(self):
+        return len(self._exact) if self._sketch is None else self._sketch.count()
+
+class StoryViews:
+    def __init__(self, database, interval=5.0, sketch_threshold=2048, max_stories=5000):
+        self.db = database
+        self.sketch_threshold = sketch_threshold
+        self._counters = LRUCache('story_views', maxsize=max_stories, ttl=24 * 3600)
+        self._lock = threading.Lock()
+        self._pending = {}  # (story_id, viewer_id) -> viewed_at
+        self._task = PeriodicTask('story-views', interval, self.flush)
+        self._views = 0
+        self._duplicates = 0
+        self._unique_views = 0
+        self._rows_written = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+
+    def _counter(self, story_id):
+        """(owner_id, UniqueViewers) for a live story, loaded on first view"""
+        entry = self._counters.get(story_id)
+        if entry is not None:
+            return entry
+
+        with self.db.connection() as conn:
+            story = conn.execute('''
+                SELECT user_id, (julianday(expires_at) - julianday('now')) * 86400 AS remaining
+                FROM stories WHERE id = ? AND expires_at > CURRENT_TIMESTAMP
+            ''', (story_id,)).fetchone()
+            if story is None:
+                return None
+            # Streamed in, so a large audience only ever exists as the sketch
+            viewers = UniqueViewers(sketch_threshold=self.sketch_threshold)
+            for row in conn.execute('SELECT viewer_id FROM story_views WHERE story_id = ?', (story_id,)):
+                viewers.add(row[0])
+
+        # Dropped when the story expires, so views of it are refused from then on
+        entry = (story['user_id'], viewers)
+        self._counters.set(story_id, entry, ttl=max(min(story['remaining'], self._counters.ttl), 0.001))
+        return entry
+
+    def record(self, story_id, viewer_id):
+        """Count a view; returns False when the story does not exist or has expired"""
+        entry = self._counter(story_id)
+        if entry is None:
+            return False
+
+        owner_id, viewers = entry
+        if owner_id == viewer_id:
+            return True
+
+        with self._lock:
+            self._views += 1
+            is_new = viewers.add(viewer_id)
+            if is_new is False:
+                self._duplicates += 1
+            else:
+                # Sketch mode cannot tell repeats apart: the row is still buffered for
+                # the viewer list (INSERT OR IGNORE dedupes it) but counts nothing,
+                # since view_count then comes from the sketch estimate
+                if is_new:
+                    self._unique_views += 1
+                self._pending.setdefault(
+                    (story_id, viewer_id), datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+                )
+
+        if not self._task.running:
+            self._task.start()
+        return True
+
+    def owner_of(self, story_id):
+        entry = self._counter(story_id)
+        return entry[0] if entry is not None else None
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        story_ids = {story_id for story_id, _ in batch}
+        exact_ids, estimates = [], []
+        for story_id in story_ids:
+            entry = self._counters.get(story_id)
+            if entry is not None and not entry[1].exact:
+                estimates.append((entry[1].count(), story_id))
+            else:
+                exact_ids.append((story_id,))
+
+        try:
+            with self.db.transaction(immediate=True) as conn:
+                # Skip stories swept since the view was buffered
+                conn.executemany('''
+                    INSERT OR IGNORE INTO story_views (story_id, viewer_id, viewed_at)
+                    SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM stories WHERE id = ?)
+                ''', [
+                    (story_id, viewer_id, viewed_at, story_id)
+                    for (story_id, viewer_id), viewed_at in batch.items()
+                ])
+                # Small audiences: exact count off the primary key; large ones: the sketch
+                conn.executemany('''
+                    UPDATE stories SET view_count = (
+                        SELECT COUNT(*) FROM story_views WHERE story_id = stories.id
+                    ) WHERE id = ?
+                ''', exact_ids)
+                conn.executemany(
+                    'UPDATE stories SET view_count = MAX(view_count, ?) WHERE id = ?',
+                    estimates
+                )
+        except Exception:
+            with self._lock:
+                for key, viewed_at in batch.items():
+                    self._pending.setdefault(key, viewed_at)
+                self._failed_flushes += 1
+            logger.exception("Story view flush failed; %d views requeued", len(batch))
+            raise
+
+        with self._lock:
+            self._rows_written += len(batch)
+            self._flushes += 1
+        return len(batch)
+
+    def viewers(self, story_id, limit=100):
+        """Who viewed a story, most recent first"""
+        self.flush()
+        with self.db.connection() as conn:
+            rows = conn.execute('''
+                SELECT u.id, u.username, u.full_name, u.profile_photo_url, v.viewed_at
+                FROM story_views v
+                JOIN users u ON u.id = v.viewer_id
+                WHERE v.story_id = ?
+                ORDER BY v.viewed_at DESC
+                LIMIT ?
+            ''', (story_id, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def drain(self):
+        """Stop the flusher and write everything still buffered"""
+        self._task.stop()
+        try:
+            self.flush()
+        except Exception:
+            logger.error("Story view drain lost %d views", len(self._pending))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'views': self._views,
+                'unique_views': self._unique_views,
+                'duplicates': self._duplicates,
+                'rows_written': self._rows_written,
+                'flushes': self._flushes,
+                'failed_flushes': self._failed_flushes,
+                'counters': self._counters.stats()
+            }
+
+story_views = StoryViews(
+    db,
+    interval=float(os.getenv('STORY_VIEW_FLUSH_INTERVAL', 5)),
+    sketch_threshold=int(os.getenv('STORY_VIEW_SKETCH_THRESHOLD', 2048)),
+    max_stories=int(os.getenv('STORY_VIEW_MAX_STORIES', 5000))
+)
+atexit.register(story_views.drain)
@@ -0,0 +1,106 @@
+"""Fan-out-on-write friend timelines.
+
+With FEED_TIMELINES=1, create_post pushes each new post id into the
+timelines table of every friend of the author, and a new friendship
+backfills each side with the other's recent posts. The friends feed is
+then a single range read of the viewer's own timeline, however many
+friends they have. Timelines hold the newest TIMELINE_SIZE posts per
+user; older entries are trimmed by a background job.
+
+Timelines are only maintained while enabled - run
+`python manage.py rebuild-timelines` after switching the flag on.
+"""
+import os
+
+from background import PeriodicTask
+
+ENABLED = os.getenv('FEED_TIMELINES', '0') == '1'
+TIMELINE_SIZE = int(os.getenv('TIMELINE_SIZE', 500))
+BACKFILL_POSTS = int(os.getenv('TIMELINE_BACKFILL', 50))
+
+def push_post(cursor, author_id, post_id):
+    """Fan a new post out to the author's friends"""
+    if not ENABLED:
+        return
+    cursor.execute('''
+        INSERT OR IGNORE INTO timelines (owner_id, post_id, author_id)
+        SELECT friend_2, ?, ? FROM friends WHERE friend_1 = ?
+        UNION ALL
+        SELECT friend_1, ?, ? FROM friends WHERE friend_2 = ?
+    ''', (post_id, author_id, author_id, post_id, author_id, author_id))
+
+def backfill_friendship(cursor, user_a, user_b):
+    """Give each side of a new friendship the other's recent posts"""
+    if not ENABLED:
+        return
+    for owner_id, author_id in ((user_a, user_b), (user_b, user_a)):
+        cursor.execute('''
+            INSERT OR IGNORE INTO timelines (owner_id, post_id, author_id)
+            SELECT ?, id, user_id FROM posts
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (owner_id, author_id, BACKFILL_POSTS))
+
+def load_page(cursor, owner_id, position=None, limit=20, offset=0):
+    from feed import FEED_COLUMNS
+    
+    after = 'AND t.post_id < ?' if position else ''
+    cursor.execute(f'''
+        SELECT {FEED_COLUMNS}
+        FROM timelines t
+        JOIN posts p ON p.id = t.post_id
+        JOIN users u ON u.id = p.user_id
+        WHERE t.owner_id = ?
+        {after}
+        ORDER BY t.post_id DESC
+        LIMIT ? OFFSET ?
+    ''', (owner_id, *(position or ()), limit, offset))
+    return [dict(post) for post in cursor.fetchall()]
+
+def rebuild(conn, size=TIMELINE_SIZE):
+    """Recompute every timeline from friends and posts"""
+    conn.execute('DELETE FROM timelines')
+    conn.execute('''
+        INSERT INTO timelines (owner_id, post_id, author_id)
+        SELECT owner_id, post_id, author_id FROM (
+            SELECT f.owner_id, p.id as post_id, p.user_id as author_id,
+                   ROW_NUMBER() OVER (PARTITION BY f.owner_id ORDER BY p.id DESC) as position
+            FROM (
+                SELECT friend_1 as owner_id, friend_2 as friend_id FROM friends
+                UNION ALL
+                SELECT friend_2, friend_1 FROM friends
+            ) f
+            JOIN posts p ON p.user_id = f.friend_id
+        )
+        WHERE position <= ?
+    ''', (size,))
+
+def trim(database, size=TIMELINE_SIZE):
+    """Drop entries beyond the newest `size` posts of each timeline"""
+    with database.transaction(immediate=True) as conn:
+        cursor = conn.execute('''
+            DELETE FROM timelines
+            WHERE (owner_id, post_id) IN (
+                SELECT owner_id, post_id FROM (
+                    SELECT owner_id, post_id,
+                           ROW_NUMBER() OVER (PARTITION BY owner_id ORDER BY post_id DESC) as position
+                    FROM timelines
+                    WHERE owner_id IN (
+                        SELECT owner_id FROM timelines GROUP BY owner_id HAVING COUNT(*) > ?
+                    )
+                )
+                WHERE position > ?
+            )
+        ''', (size, size))
+        return cursor.rowcount
+
+_trimmer = None
+
+def start_trimmer(database):
+    global _trimmer
+    interval = float(os.getenv('TIMELINE_TRIM_INTERVAL', 600))
+    if not ENABLED or interval <= 0 or _trimmer is not None:
+        return
+    _trimmer = PeriodicTask('timeline-trim', interval, lambda: trim(database))
+    _trimmer.start()
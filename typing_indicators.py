@@ -0,0 +1,171 @@
+"""Server-side coalescing of typing indicators.
+
+Clients send typing_start/typing_stop on every keystroke burst. State is
+tracked per (user, chat room) and a change is forwarded to the room at
+most once per TYPING_EMIT_INTERVAL: repeats of the current state are
+dropped, and a change that comes too soon is held and sent (if still
+current) when the interval is up. A start/stop pair inside one interval
+therefore sends nothing at all.
+
+Idle states sit in a timer wheel with TYPING_TICK second slots. A user
+who stops sending events for TYPING_TTL seconds (closed tab, lost
+connection) gets a user_stopped_typing on their behalf.
+"""
+import math
+import os
+import threading
+import time
+
+from background import PeriodicTask
+from socket_state import socket_state
+
+def chat_room(user_id, other_user_id):
+    return f"chat_{min(user_id, other_user_id)}_{max(user_id, other_user_id)}"
+
+class TypingIndicators:
+    def __init__(self, interval=1.0, ttl=6.0, tick=0.5):
+        self.interval = interval
+        self.ttl = ttl
+        self.tick_seconds = tick
+        self._lock = threading.Lock()
+        self._states = {}  # (user_id, room) -> state dict
+        self._pending = set()  # keys holding a change until their interval is up
+        self._wheel = [set() for _ in range(int(math.ceil(ttl / tick)) + 1)]
+        self._position = 0
+        self._task = PeriodicTask('typing-indicators', tick, self.tick)
+        self._received = 0
+        self._forwarded = 0
+        self._suppressed = 0
+        self._expired = 0
+    
+    def start(self, sid, user_id, other_user_id, username=None):
+        self._event(sid, user_id, other_user_id, True, username)
+    
+    def stop(self, sid, user_id, other_user_id):
+        self._event(sid, user_id, other_user_id, False)
+    
+    def _event(self, sid, user_id, other_user_id, typing, username=None):
+        key = (user_id, chat_room(user_id, other_user_id))
+        with self._lock:
+            self._received += 1
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = {'typing': False, 'pending': None, 'emitted_at': 0.0, 'slot': None}
+            state.update(sid=sid, other_user_id=other_user_id)
+            if username is not None:
+                state['username'] = username
+            self._schedule(key, state)
+            emit = self._change(key, state, typing)
+        
+        if emit:
+            self._emit(key, state, typing)
+        if not self._task.running:
+            self._task.start()
+    
+    def _change(self, key, state, typing):
+        """Apply a requested state; True when it should be emitted right now"""
+        if state['typing'] == typing:
+            state['pending'] = None
+            self._pending.discard(key)
+            self._suppressed += 1
+            return False
+        
+        now = time.monotonic()
+        if now - state['emitted_at'] >= self.interval:
+            state['typing'] = typing
+            state['pending'] = None
+            state['emitted_at'] = now
+            self._pending.discard(key)
+            self._forwarded += 1
+            return True
+        
+        state['pending'] = typing
+        self._pending.add(key)
+        self._suppressed += 1
+        return False
+    
+    def _schedule(self, key, state):
+        """(Re)arm the idle timer of a key in the wheel"""
+        if state['slot'] is not None:
+            self._wheel[state['slot']].discard(key)
+        slot = (self._position + int(math.ceil(self.ttl / self.tick_seconds))) % len(self._wheel)
+        self._wheel[slot].add(key)
+        state['slot'] = slot
+    
+    def tick(self):
+        emits = []
+        now = time.monotonic()
+        
+        with self._lock:
+            self._position = (self._position + 1) % len(self._wheel)
+            due, self._wheel[self._position] = self._wheel[self._position], set()
+            for key in due:
+                state = self._states.pop(key)
+                self._pending.discard(key)
+                if state['typing']:
+                    self._expired += 1
+                    self._forwarded += 1
+                    emits.append((key, state, False))
+            
+            for key in list(self._pending):
+                state = self._states[key]
+                if now - state['emitted_at'] >= self.interval:
+                    self._pending.discard(key)
+                    typing, state['pending'] = state['pending'], None
+                    state['typing'] = typing
+                    state['emitted_at'] = now
+                    self._forwarded += 1
+                    emits.append((key, state, typing))
+        
+        for key, state, typing in emits:
+            self._emit(key, state, typing)
+    
+    def disconnected(self, sid):
+        """A socket went away: stop whatever it was typing"""
+        emits = []
+        with self._lock:
+            for key, state in list(self._states.items()):
+                if state['sid'] != sid:
+                    continue
+                del self._states[key]
+                self._wheel[state['slot']].discard(key)
+                self._pending.discard(key)
+                if state['typing']:
+                    self._forwarded += 1
+                    emits.append((key, state, False))
+        
+        for key, state, typing in emits:
+            self._emit(key, state, typing)
+    
+    def _emit(self, key, state, typing):
+        from extensions import socketio
+        
+        user_id, room = key
+        if typing:
+            socket_state.set_typing(state['sid'], user_id, state['other_user_id'])
+            socketio.emit('user_typing', {
+                'user_id': user_id,
+                'username': state.get('username')
+            }, room=room, skip_sid=state['sid'])
+        else:
+            socket_state.clear_typing(state['sid'])
+            socketio.emit('user_stopped_typing', {
+                'user_id': user_id
+            }, room=room, skip_sid=state['sid'])
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._states),
+                'pending': len(self._pending),
+                'received': self._received,
+                'forwarded': self._forwarded,
+                'suppressed': self._suppressed,
+                'expired': self._expired
+            }
+
+typing_indicators = TypingIndicators(
+    interval=float(os.getenv('TYPING_EMIT_INTERVAL', 1)),
+    ttl=float(os.getenv('TYPING_TTL', 6)),
+    tick=float(os.getenv('TYPING_TICK', 0.5))
+)
@@ -1,6 +1,9 @@
 import random
 import string
 import hashlib
+import base64
+import json
+import os
 from datetime import datetime, timedelta
 
 def generate_teengram_number(username):
@@ -16,50 +19,108 @@ def generate_device_fingerprint(user_agent, ip_address):
     return hashlib.md5(data.encode()).hexdigest()
 
 def award_points(user_id, points, reason):
-    """Award points to user"""
+    """Award points to user (joins the caller's transaction if there is one)"""
     from database import db
-    conn = db.get_connection()
-    cursor = conn.cursor()
+    from ledger import points_ledger
+    if points_ledger is not None:
+        # Buffered mode: queued for the ledger's next batch flush once the
+        # caller's transaction (if any) commits; has_pending() sees it meanwhile
+        award = points_ledger.reserve(user_id, points, reason)
+        db.after_rollback(points_ledger.release, award)
+        db.after_commit(points_ledger.enqueue, award)
+        return
     
-    # Add to points table
-    cursor.execute(
-        'INSERT INTO points (user_id, points, reason) VALUES (?, ?, ?)',
-        (user_id, points, reason)
-    )
-    
-    # Update user total points
-    cursor.execute(
-        'UPDATE users SET points = points + ? WHERE id = ?',
-        (points, user_id)
-    )
-    
-    conn.commit()
-    conn.close()
+    with db.transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        
+        # Add to points table
+        cursor.execute(
+            'INSERT INTO points (user_id, points, reason) VALUES (?, ?, ?)',
+            (user_id, points, reason)
+        )
+        
+        # Update user total points
+        cursor.execute(
+            'UPDATE users SET points = points + ? WHERE id = ?',
+            (points, user_id)
+        )
+        
+        # Only once the points are really stored (the caller may roll back)
+        from leaderboard import leaderboard
+        db.after_commit(leaderboard.award, user_id, points)
+
+BAN_CLEAR_TTL = float(os.getenv('BAN_CACHE_CLEAR_TTL', 5))
 
 def check_ban_status(user_id):
-    """Check if user is currently banned"""
-    from database import db
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT * FROM bans 
-        WHERE user_id = ? AND (is_permanent = TRUE OR ban_end > CURRENT_TIMESTAMP)
-        ORDER BY ban_start DESC LIMIT 1
-    ''', (user_id,))
+    """Check if user is currently banned (cached; see cache.ban_cache)"""
+    from cache import ban_cache
+    user_id = int(user_id)
+    status = ban_cache.get(user_id)
+    if status is not None:
+        return status
     
-    ban = cursor.fetchone()
-    conn.close()
+    from database import db
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM bans 
+            WHERE user_id = ? AND (is_permanent = TRUE OR ban_end > CURRENT_TIMESTAMP)
+            ORDER BY ban_start DESC LIMIT 1
+        ''', (user_id,))
+        
+        ban = cursor.fetchone()
     
     if ban:
-        return {
+        status = {
             'is_banned': True,
             'reason': ban['reason'],
             'ban_end': ban['ban_end'],
             'is_permanent': ban['is_permanent']
         }
+    else:
+        status = {'is_banned': False}
+    
+    ttl = None
+    if not ban:
+        # Bans reach other workers through invalidate_ban; if that message
+        # is lost, "not banned" is still trusted for a few seconds at most
+        ttl = BAN_CLEAR_TTL
+    elif not ban['is_permanent'] and ban['ban_end']:
+        # ban_user writes ban_end as local time; drop the entry the moment it passes
+        remaining = (datetime.fromisoformat(ban['ban_end']) - datetime.now()).total_seconds()
+        ttl = max(min(remaining, ban_cache.ttl), 1)
+    ban_cache.set(user_id, status, ttl=ttl)
     
-    return {'is_banned': False}
+    return status
+
+def encode_cursor(*values):
+    """Encode keyset position values into an opaque pagination token"""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, size):
+    """Decode a token from encode_cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    # Positions are (score, id) or (id,): numbers, with an integer id last
+    if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in values) \
+            or not isinstance(values[-1], int):
+        raise ValueError("Invalid cursor")
+    return values
+
+def page_limit(args, default, maximum):
+    """Read ?limit= from request args, clamped to 1..maximum"""
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
 
 def validate_file_upload(file):
     """Validate uploaded files"""